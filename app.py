@@ -1,14 +1,19 @@
 import dash
+import hashlib
 import json
+import os
+import threading
 import networkx as nx
+import pandas as pd
 import plotly.graph_objs as go
 import plotly.express as px
-import numpy as np
+from collections import deque
 from lorem_text import lorem
-from mcmc_driver import *
-from generate_data import get_colorado_graph
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from chain import MarkovChain
+from partition import Partition
+from generate_data import get_colorado_graph, get_colorado_districts
+from dash import dcc, html, Patch
+from dash.dependencies import Input, Output, State
 from plotly.subplots import make_subplots
 
 # Create a Dash app
@@ -16,7 +21,12 @@ app = dash.Dash(__name__, suppress_callback_exceptions = True)
 
 # necessary constants
 PAGE_TITLE = "Working Project Site, CS 333"
-ITERATION_INTERVAL_MS = 1000
+LAYOUT_CACHE_DIR = ".cache"
+ITERATION_INTERVAL_MS = 250
+STEPS_PER_BATCH = 100
+MAX_EVENTS = 100000
+MAX_SCORE_POINTS = 5000
+DISTRICT_COLORS = px.colors.qualitative.Plotly
 
 # static functin for format text that appears when hovering over a node
 def format_hover_text(node) -> str:
@@ -26,29 +36,140 @@ def format_hover_text(node) -> str:
     return output
 
 # get a list of all node colors for displaying on the graph
-def get_node_colors(G) -> list:
-    # colors = [G.nodes()[n]["color"] for n in G.nodes()]
-    colors = [np.random.choice(["red", "green", "blue"], p = (0.3, 0.3, 0.4)) for
-              _ in G.nodes()]
+def get_node_colors(assignment) -> list:
+    colors = [DISTRICT_COLORS[d % len(DISTRICT_COLORS)] for d in assignment]
     return colors
 
-# Create a sample NetworkX graph
+
+"""
+ChainStream class
+Runs a MarkovChain in a background thread and keeps a log of what changed,
+so each browser tick only has to send the nodes that moved and the new score
+points instead of the whole figure.
+
+    events: (step, node, district) for every accepted move, newest last
+    scores: (step, score) after every batch of STEPS_PER_BATCH steps
+
+The chain steps outside the lock, so its partition may be holding a proposal
+that is about to be rejected. Pages are only ever shown the copy of the plan
+published at the end of each batch.
+
+Both logs are bounded. A page that fell further behind than the event log
+reaches gets a full set of node colors instead.
+"""
+class ChainStream:
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.lock = threading.Lock()
+        self.events = deque(maxlen = MAX_EVENTS)
+        self.scores = deque([(0, chain.score)], maxlen = MAX_SCORE_POINTS)
+        self.assignment = chain.partition.assignment.copy()
+        self.district_population = chain.partition.district_population.copy()
+        self.step = 0
+        self.thread = threading.Thread(target = self._run, daemon = True)
+
+    def start(self):
+        self.thread.start()
+
+    # sample forever, publishing the results one batch at a time
+    def _run(self):
+        while True:
+            batch = []
+            for _ in range(STEPS_PER_BATCH):
+                node, _, district, accepted = self.chain.step()
+                if accepted:
+                    batch.append((self.chain.step_count, node, district))
+            assignment = self.chain.partition.assignment.copy()
+            district_population = self.chain.partition.district_population.copy()
+            with self.lock:
+                self.assignment = assignment
+                self.district_population = district_population
+                self.events.extend(batch)
+                self.step = self.chain.step_count
+                self.scores.append((self.step, self.chain.score))
+
+    # population of each district as of the last batch
+    def populations(self) -> list:
+        with self.lock:
+            return self.district_population.tolist()
+
+    # current step, node colors and score history, for a freshly loaded page
+    def snapshot(self) -> tuple:
+        with self.lock:
+            return self.step, get_node_colors(self.assignment), list(self.scores)
+
+    # everything that happened after `step`, as (new step, {node: district},
+    # all node colors, [(step, score), ...]); the moved nodes are None and the
+    # colors are given instead if some of those moves were already dropped
+    def changes_since(self, step) -> tuple:
+        with self.lock:
+            # once the log is full, moves older than its first event may be gone
+            full = len(self.events) == self.events.maxlen
+            if full and step < self.events[0][0] - 1:
+                moved = None
+                colors = get_node_colors(self.assignment)
+            else:
+                moved = {node: district for s, node, district in self.events if s > step}
+                colors = None
+            scores = [(s, score) for s, score in self.scores if s > step]
+            return self.step, moved, colors, scores
+
+
+# hash of a graph's nodes and edges, used to key the layout cache
+def graph_hash(graph) -> str:
+    digest = hashlib.sha256()
+    digest.update(repr(sorted(graph.nodes())).encode())
+    digest.update(repr(sorted(tuple(sorted(edge)) for edge in graph.edges())).encode())
+    return digest.hexdigest()
+
+
+# spring layout of a graph, computed once and then loaded from disk
+def load_layout(graph, cache_dir = LAYOUT_CACHE_DIR) -> dict:
+    path = os.path.join(cache_dir, f"layout_{graph_hash(graph)}.json")
+    if os.path.exists(path):
+        with open(path) as layout_file:
+            saved = json.load(layout_file)
+        return {node: tuple(saved[str(node)]) for node in graph.nodes()}
+
+    layout = nx.spring_layout(graph, seed = 46)
+    os.makedirs(cache_dir, exist_ok = True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as layout_file:
+        json.dump({str(node): [float(x), float(y)] for node, (x, y) in layout.items()},
+                  layout_file)
+    os.replace(temp_path, path)
+    return {node: tuple(xy) for node, xy in layout.items()}
+
+
+# Create the Colorado graph
 G = get_colorado_graph()
 
 # set initial positions of nodes, which remain static
-pos = nx.spring_layout(G)
+pos = load_layout(G)
+
+# everything about the graph figure that never changes, computed once
+NODE_X = [pos[node][0] for node in G.nodes()]
+NODE_Y = [pos[node][1] for node in G.nodes()]
+HOVER_TEXT = [format_hover_text(G.nodes()[i]) for i in G.nodes()]
+EDGE_X = []
+EDGE_Y = []
+for edge in G.edges():
+    x0, y0 = pos[edge[0]]
+    x1, y1 = pos[edge[1]]
+    EDGE_X.extend((x0, x1, None))
+    EDGE_Y.extend((y0, y1, None))
+
+# start the chain from Colorado's current congressional districts
+partition = Partition.from_subgraphs(G, get_colorado_districts())
+stream = ChainStream(MarkovChain(partition, beta = 0.05, c_pop = 0.000000005))
 
 
 def bar_chart_data():
     # creates a dictionary to store the population per district created by mcmc
     district_populations = {}
-    for node in G.nodes():
-        color = G.nodes()[node]["color"]
-        population = G.nodes()[node]["population"]
-        if color in district_populations:
-            district_populations[color] += population
-        else: 
-            district_populations[color] = population
+    for district, population in enumerate(stream.populations()):
+        district_populations[f"District {district + 1}"] = int(population)
     #Creates a dataset from the populations dictionary
     data = {}
     data['Districts'] = list(district_populations.keys())
@@ -58,72 +179,39 @@ def bar_chart_data():
 
 
 dummy_hist = px.histogram(
-    x = populations, 
-    nbins = 10, 
+    x = [G.nodes[node]["population"] for node in G.nodes()],
+    nbins = 10,
     title = "Population Distribution of Colorado Counties",
     template = "ggplot2",
     labels = dict(x = "Population")
 )
 dummy_hist.update_layout(yaxis_title = "Number of Districts")
 
-# Create a layout with a plotly subplot
-app.layout = html.Div([
-    html.H1(PAGE_TITLE),
-    html.P(lorem.words(200)),
-    html.Div(
-        dcc.Graph(id = 'graph-animation'),
-        style = {"width": "65%", "display": "inline-block"}
-    ),
-    html.Div(
-        dcc.Graph(id = "demo-hist", figure = dummy_hist),
-        style = {"width": "35%", "display": "inline-block"}
-    ),
-    dcc.Interval(
-        id = 'interval-component',
-        interval = ITERATION_INTERVAL_MS,
-        n_intervals = 0
-    )
-],
-    style = {"margin": "50px"}
-)
 
-# Define callback to update graph colors over time
-@app.callback(
-    Output('graph-animation', 'figure'),
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n):
-    # Create a subplot with NetworkX graph and update node colors
+# build the static part of the graph figure, once
+def build_base_figure() -> dict:
+    # Create a subplot with NetworkX graph
     fig = make_subplots(rows=1, cols=1)
 
-    # display the graph nodes
-    node_trace = go.Scatter(
-        x = [pos[node][0] for node in G.nodes()],
-        y = [pos[node][1] for node in G.nodes()],
-        text = [format_hover_text(G.nodes()[i]) for i in G.nodes()],
-        mode = 'markers',
-        hoverinfo = 'text',
-        marker = dict(
-            size = 15,
-            color = get_node_colors(G)
-        ),
-        hoverlabel = dict(font = {"color": "white"})
-    )
-
     # display the graph edges
     edges_trace = go.Scatter(
-        x = [],
-        y = [],
+        x = EDGE_X,
+        y = EDGE_Y,
         line = dict(width = 1.5, color = "gray"),
         hoverinfo = 'none',
         mode = 'lines'
     )
 
-    for edge in G.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edges_trace['x'] += tuple([x0, x1, None])
-        edges_trace['y'] += tuple([y0, y1, None])
+    # display the graph nodes
+    node_trace = go.Scatter(
+        x = NODE_X,
+        y = NODE_Y,
+        text = HOVER_TEXT,
+        mode = 'markers',
+        hoverinfo = 'text',
+        marker = dict(size = 15),
+        hoverlabel = dict(font = {"color": "white"})
+    )
 
     # add visualizations to figure
     fig.add_trace(edges_trace)
@@ -138,8 +226,94 @@ def update_graph(n):
         paper_bgcolor = "rgba(0,0,0,0)"
     )
 
+    return fig.to_dict()
+
+BASE_FIGURE = build_base_figure()
+
+
+# the graph figure with the given node colors; after this only colors are sent
+# the static traces are shared with BASE_FIGURE rather than rebuilt or copied
+def build_graph_figure(colors) -> dict:
+    edges_trace, node_trace = BASE_FIGURE["data"]
+    node_trace = dict(node_trace, marker = dict(node_trace["marker"], color = colors))
+    return dict(BASE_FIGURE, data = [edges_trace, node_trace])
+
+
+# build the score-over-time figure; after this only new points are ever sent
+def build_score_figure(scores):
+    fig = go.Figure(go.Scatter(
+        x = [step for step, _ in scores],
+        y = [score for _, score in scores],
+        mode = 'lines'
+    ))
+    fig.update_layout(
+        title = "MCMC Redistricting Total Score Over Time",
+        xaxis_title = "Iteration",
+        yaxis_title = "Score",
+        template = "ggplot2"
+    )
     return fig
 
+
+# Create a layout with a plotly subplot
+# the layout is a function so every page load starts from the chain's current plan
+def serve_layout():
+    step, colors, scores = stream.snapshot()
+    return html.Div([
+        html.H1(PAGE_TITLE),
+        html.P(lorem.words(200)),
+        html.Div(
+            dcc.Graph(id = 'graph-animation', figure = build_graph_figure(colors)),
+            style = {"width": "65%", "display": "inline-block"}
+        ),
+        html.Div(
+            dcc.Graph(id = "demo-hist", figure = dummy_hist),
+            style = {"width": "35%", "display": "inline-block"}
+        ),
+        dcc.Graph(id = "score-trace", figure = build_score_figure(scores)),
+        dcc.Store(id = "stream-step", data = step),
+        dcc.Interval(
+            id = 'interval-component',
+            interval = ITERATION_INTERVAL_MS,
+            n_intervals = 0
+        )
+    ],
+        style = {"margin": "50px"}
+    )
+
+app.layout = serve_layout
+
+# Define callback to push the chain's progress to the page
+# only the recolored nodes and the new score points are sent, using Patch
+@app.callback(
+    [Output('graph-animation', 'figure'),
+     Output('score-trace', 'figure'),
+     Output('stream-step', 'data')],
+    [Input('interval-component', 'n_intervals')],
+    [State('stream-step', 'data')],
+    prevent_initial_call = True
+)
+def update_graph(n, step):
+    new_step, moved, colors, scores = stream.changes_since(step)
+    if new_step == step:
+        return dash.no_update, dash.no_update, dash.no_update
+
+    # recolor only the nodes that moved (or all of them, if this page fell behind)
+    graph_patch = Patch()
+    if colors is not None:
+        graph_patch["data"][1]["marker"]["color"] = colors
+    else:
+        for node, district in moved.items():
+            color = DISTRICT_COLORS[district % len(DISTRICT_COLORS)]
+            graph_patch["data"][1]["marker"]["color"][node] = color
+
+    score_patch = Patch()
+    score_patch["data"][0]["x"].extend([s for s, _ in scores])
+    score_patch["data"][0]["y"].extend([score for _, score in scores])
+
+    return graph_patch, score_patch, new_step
+
 # Run the app
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    stream.start()
+    app.run(debug=True, use_reloader=False)
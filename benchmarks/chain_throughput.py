@@ -0,0 +1,357 @@
+import argparse
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import deque
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from csr_graph import CSRGraph, get_colorado_csr_graph
+from generate_data import get_colorado_districts
+from partition import Partition, flip_keeps_district_connected
+from moves import MoveGenerator, CutEdgeMoveGenerator
+from recom import ReCom
+from chain import MarkovChain
+from streams import RandomStream
+
+"""
+Chain throughput benchmark
+Measures how many operations per second each stage of a chain step manages,
+on the Colorado county graph and on generated graphs of increasing size:
+
+    proposal     drawing a move (moves.random_move)
+    validity     local contiguity check of a move (flip_keeps_district_connected,
+                 or the notebook's nx.is_connected check for mcmc_driver)
+    scoring      score change of a move (ScoreEngine.flip_delta / move_delta,
+                 or totalscorefunction for mcmc_driver)
+    acceptance   applying a move and undoing it again, as for a rejected step
+                 (for mcmc_driver: counting the border edges before and after)
+    step         one full iteration of the chain
+
+Each stage is run for every move generator: "flip" (MoveGenerator), "cut_edge"
+(CutEdgeMoveGenerator), "recom" (ReCom) and "mcmc_driver" (the notebook's
+original loop over networkx subgraphs, only run on small graphs). Setup times
+(building the graph, the Partition and the chain) are recorded too.
+
+    python benchmarks/chain_throughput.py
+    python benchmarks/chain_throughput.py --graphs grid --sizes 1000 10000
+    python benchmarks/chain_throughput.py --compare benchmarks/results/old.json
+
+Results are written as JSON (one record per graph, generator and stage), and
+--compare prints the speedup of every matching record against an older run.
+"""
+
+GRAPHS = ["colorado", "grid", "planar"]
+SIZES = [1000, 10000, 100000, 1000000]
+GENERATORS = ["flip", "cut_edge", "recom", "mcmc_driver"]
+STAGES = ["proposal", "validity", "scoring", "acceptance", "step"]
+NUM_DISTRICTS = 8
+
+# the notebook's population weight, which keeps acceptance rates realistic
+CHAIN_ARGS = dict(beta = 0.05, c_pop = 0.000000005)
+
+
+# square grid graph with about `size` nodes
+def grid_graph(size, rng) -> tuple:
+    side = max(2, int(round(size ** 0.5)))
+    ids = np.arange(side * side).reshape(side, side)
+    edges = np.concatenate([
+        np.column_stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()]),
+        np.column_stack([ids[:-1, :].ravel(), ids[1:, :].ravel()])
+    ])
+    return side * side, edges
+
+
+# random planar graph with about `size` nodes: a grid whose cells are each
+# split by one randomly chosen diagonal, giving degrees between 2 and 8
+def planar_graph(size, rng) -> tuple:
+    side = max(2, int(round(size ** 0.5)))
+    n, edges = grid_graph(side * side, rng)
+    ids = np.arange(n).reshape(side, side)
+    flip = rng.random((side - 1, side - 1)) < 0.5
+    diagonals = np.where(
+        flip[..., None],
+        np.stack([ids[:-1, :-1], ids[1:, 1:]], axis = -1),
+        np.stack([ids[:-1, 1:], ids[1:, :-1]], axis = -1)
+    ).reshape(-1, 2)
+    return n, np.concatenate([edges, diagonals])
+
+
+# districts grown by breadth-first search from random seed nodes, so every
+# district is connected
+def seeded_districts(graph, k, rng) -> np.ndarray:
+    assignment = np.full(len(graph), -1, dtype = np.int64)
+    queue = deque()
+    for district, seed in enumerate(rng.choice(len(graph), k, replace = False).tolist()):
+        assignment[seed] = district
+        queue.append(seed)
+    neighbors = graph.neighbor_lists()
+    while queue:
+        u = queue.popleft()
+        for v in neighbors[u]:
+            if assignment[v] < 0:
+                assignment[v] = assignment[u]
+                queue.append(v)
+    return assignment
+
+
+# graph and starting plan for one benchmark case
+def build_case(name, size, seed) -> tuple:
+    if name == "colorado":
+        graph = get_colorado_csr_graph()
+        return graph, Partition.from_subgraphs(graph, get_colorado_districts()).assignment
+
+    rng = np.random.default_rng(seed)
+    n, edges = (grid_graph if name == "grid" else planar_graph)(size, rng)
+    population = rng.integers(500, 5000, n)
+    pvi = rng.integers(-30, 31, n)
+    graph = CSRGraph.from_edges(n, edges, population, pvi)
+    return graph, seeded_districts(graph, NUM_DISTRICTS, rng)
+
+
+# run `operation(count)` with growing counts until `budget` seconds have
+# passed, returning (operations, seconds)
+def measure(operation, budget, max_operations) -> tuple:
+    total = 0
+    elapsed = 0.0
+    count = 1
+    while elapsed < budget and total < max_operations:
+        count = min(count, max_operations - total)
+        start = time.perf_counter()
+        operation(count)
+        elapsed += time.perf_counter() - start
+        total += count
+        count *= 2
+    return total, elapsed
+
+
+# stage operations for the array-based chain with one of the move generators
+def engine_stages(graph, assignment, generator, seed) -> tuple:
+    factories = dict(flip = MoveGenerator, cut_edge = CutEdgeMoveGenerator,
+                     recom = functools.partial(ReCom, epsilon = 0.5))
+
+    setup = {}
+    start = time.perf_counter()
+    partition = Partition(graph, assignment, NUM_DISTRICTS)
+    setup["partition"] = time.perf_counter() - start
+    start = time.perf_counter()
+    chain = MarkovChain(partition, rng = RandomStream(seed),
+                        move_generator = factories[generator], **CHAIN_ARGS)
+    setup["chain"] = time.perf_counter() - start
+
+    rng = RandomStream(seed)
+    moves = chain.moves
+    scorer = chain.scorer
+    delta = scorer.move_delta if generator == "recom" else scorer.flip_delta
+
+    # a pool of proposals from the starting plan, reused by the stages below
+    pool = [moves.random_move(rng) for _ in range(8 if generator == "recom" else 64)]
+
+    def proposal(count):
+        for _ in range(count):
+            moves.random_move(rng)
+
+    def validity(count):
+        for i in range(count):
+            u, v = partition.random_cut_edge(rng)
+            flip_keeps_district_connected(partition, u if i % 2 else v)
+
+    def scoring(count):
+        for i in range(count):
+            delta(*pool[i % len(pool)])
+
+    def acceptance(count):
+        for i in range(count):
+            moves.propose(*pool[i % len(pool)])
+            moves.reject()
+
+    def step(count):
+        for _ in range(count):
+            chain.step()
+
+    stages = dict(proposal = proposal, validity = validity, scoring = scoring,
+                  acceptance = acceptance, step = step)
+    return setup, stages
+
+
+# stage operations for the notebook's original loop, using mcmc_driver
+def mcmc_driver_stages(graph, assignment, seed) -> tuple:
+    import networkx as nx
+    import mcmc_driver
+
+    start = time.perf_counter()
+    nx_graph = graph.to_networkx()
+    subgraphs = [nx_graph.subgraph(np.flatnonzero(assignment == d).tolist())
+                 for d in range(NUM_DISTRICTS)]
+    setup = dict(partition = time.perf_counter() - start)
+    mcmc_driver.set_seed(seed)
+
+    def connected(candidate, candidate_subgraphs):
+        return all(len(s) > 0 and nx.is_connected(candidate.subgraph(s.nodes()))
+                   for s in candidate_subgraphs)
+
+    # one proposal from the starting plan, reused by the stages below
+    edge = mcmc_driver.get_random_edge_between_subgraphs(nx_graph, subgraphs)
+    _, proposed = mcmc_driver.create_proposed_state(nx_graph, subgraphs, edge)
+
+    def proposal(count):
+        for _ in range(count):
+            edge = mcmc_driver.get_random_edge_between_subgraphs(nx_graph, subgraphs)
+            mcmc_driver.create_proposed_state(nx_graph, subgraphs, edge)
+
+    def validity(count):
+        for _ in range(count):
+            connected(nx_graph, proposed)
+
+    def scoring(count):
+        for _ in range(count):
+            mcmc_driver.totalscorefunction(nx_graph, subgraphs, c_pop = CHAIN_ARGS["c_pop"])
+
+    # the notebook's Modified_one_iteration_of_MCMC_colorado, with the proposal
+    # from get_a_valid_conflicted_edge_colorado
+    state = dict(subgraphs = subgraphs)
+
+    def one_iteration():
+        current = state["subgraphs"]
+        while True:
+            edge = mcmc_driver.get_random_edge_between_subgraphs(nx_graph, current)
+            _, proposed = mcmc_driver.create_proposed_state(nx_graph, current, edge)
+            if connected(nx_graph, proposed):
+                break
+        con1 = len(mcmc_driver.get_edges_between_subgraphs(nx_graph, current))
+        con2 = len(mcmc_driver.get_edges_between_subgraphs(nx_graph, proposed))
+        current_score = mcmc_driver.totalscorefunction(nx_graph, current,
+                                                       c_pop = CHAIN_ARGS["c_pop"])
+        proposed_score = mcmc_driver.totalscorefunction(nx_graph, proposed,
+                                                        c_pop = CHAIN_ARGS["c_pop"])
+        exponent = min(0.0, -CHAIN_ARGS["beta"] * (proposed_score - current_score))
+        if mcmc_driver.rng.random() < min(1, con1 / con2, np.exp(exponent)):
+            state["subgraphs"] = proposed
+
+    # the border edge counts and the random draw that decide acceptance
+    def acceptance(count):
+        for _ in range(count):
+            con1 = len(mcmc_driver.get_edges_between_subgraphs(nx_graph, subgraphs))
+            con2 = len(mcmc_driver.get_edges_between_subgraphs(nx_graph, proposed))
+            mcmc_driver.rng.random() < min(1, con1 / con2)
+
+    def step(count):
+        for _ in range(count):
+            one_iteration()
+
+    stages = dict(proposal = proposal, validity = validity, scoring = scoring,
+                  acceptance = acceptance, step = step)
+    return setup, stages
+
+
+# run every stage of one generator on one graph, returning result records
+def run_case(name, size, graph, assignment, generator, budget, max_operations,
+             seed) -> list:
+    case = dict(graph = name, nodes = len(graph), edges = graph.num_edges,
+                generator = generator)
+    if generator == "mcmc_driver":
+        setup, stages = mcmc_driver_stages(graph, assignment, seed)
+    else:
+        setup, stages = engine_stages(graph, assignment, generator, seed)
+
+    records = [dict(case, stage = f"setup_{key}", operations = 1, seconds = value,
+                    per_second = 1 / value if value > 0 else None)
+               for key, value in setup.items()]
+    for stage in STAGES:
+        operations, seconds = measure(stages[stage], budget, max_operations)
+        records.append(dict(case, stage = stage, operations = operations,
+                            seconds = seconds, per_second = operations / seconds))
+    return records
+
+
+# information about the machine and the code, stored with every run
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd = ROOT,
+                                capture_output = True, text = True).stdout.strip()
+    except OSError:
+        commit = None
+    return dict(
+        time = time.strftime("%Y-%m-%dT%H:%M:%S"),
+        commit = commit,
+        python = platform.python_version(),
+        numpy = np.__version__,
+        machine = platform.machine(),
+        processor = platform.processor(),
+        cpu_count = os.cpu_count()
+    )
+
+
+# print the speedup of every record that also appears in an older run
+def compare(results, old_path):
+    with open(old_path) as old_file:
+        old = json.load(old_file)
+    key = lambda r: (r["graph"], r["nodes"], r["generator"], r["stage"])
+    before = {key(r): r for r in old["results"]}
+    print(f"\ncompared with {old_path} ({old['environment'].get('commit')})")
+    for record in results:
+        match = before.get(key(record))
+        if match and match["per_second"] and record["per_second"]:
+            ratio = record["per_second"] / match["per_second"]
+            flag = "  <-- slower" if ratio < 0.9 else ""
+            print(f"{record['graph']:<9}{record['nodes']:>9} {record['generator']:<12}"
+                  f"{record['stage']:<18}{ratio:>7.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Chain throughput benchmark")
+    parser.add_argument("--graphs", nargs = "+", default = GRAPHS, choices = GRAPHS)
+    parser.add_argument("--sizes", nargs = "+", type = int, default = SIZES,
+                        help = "node counts of the generated graphs")
+    parser.add_argument("--generators", nargs = "+", default = GENERATORS,
+                        choices = GENERATORS)
+    parser.add_argument("--budget", type = float, default = 1.0,
+                        help = "seconds spent on each stage")
+    parser.add_argument("--max-operations", type = int, default = 100000)
+    parser.add_argument("--mcmc-driver-max-nodes", type = int, default = 10000,
+                        help = "largest graph the original mcmc_driver loop is run on")
+    parser.add_argument("--seed", type = int, default = 46)
+    parser.add_argument("--json", default = os.path.join(
+        ROOT, "benchmarks", "results", time.strftime("throughput_%Y%m%d_%H%M%S.json")))
+    parser.add_argument("--compare", help = "earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    cases = [(name, size) for name in args.graphs
+             for size in ([None] if name == "colorado" else args.sizes)]
+
+    results = []
+    print(f"{'graph':<9}{'nodes':>9} {'generator':<12}{'stage':<18}{'per second':>14}")
+    print("(setup stages show seconds instead)")
+    for name, size in cases:
+        start = time.perf_counter()
+        graph, assignment = build_case(name, size, args.seed)
+        build_time = time.perf_counter() - start
+
+        for generator in args.generators:
+            if generator == "mcmc_driver" and len(graph) > args.mcmc_driver_max_nodes:
+                continue
+            records = run_case(name, size, graph, assignment, generator, args.budget,
+                               args.max_operations, args.seed)
+            records.insert(0, dict(records[0], stage = "setup_graph", operations = 1,
+                                   seconds = build_time, per_second = 1 / build_time))
+            for record in records:
+                value = (f"{record['seconds']:>13.3f}s" if record["stage"].startswith("setup")
+                         else f"{record['per_second']:>14.1f}")
+                print(f"{record['graph']:<9}{record['nodes']:>9} {record['generator']:<12}"
+                      f"{record['stage']:<18}{value}")
+            results.extend(records)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok = True)
+    with open(args.json, "w") as output_file:
+        json.dump(dict(environment = environment(), results = results), output_file,
+                  indent = 2)
+    print(f"\nwrote {args.json}")
+
+    if args.compare:
+        compare(results, args.compare)
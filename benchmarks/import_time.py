@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+"""
+Import-time benchmark
+Imports each module of the sampling engine in a fresh interpreter and reports
+how long the import took, which heavy modules it loaded and which of the
+repository's data files it opened. Worker processes import these modules, so
+any of that cost is paid once per worker.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --json import_time.json
+
+Exits with status 1 if an import loads a forbidden module or opens a file in
+the repository that is not Python source, so it can also be run as a check.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "partition", "moves", "scoring", "trajectory", "fliplog", "checkpoint",
+    "streams", "profiling", "chain", "tempering", "sweep", "generate_data", "mcmc_driver"
+]
+
+# modules that importing the sampling engine must not pull in
+FORBIDDEN = ["matplotlib", "plotly", "IPython", "dash", "pandas", "seaborn"]
+
+# run in the child interpreter: time one import and record what it touched
+PROBE = """
+import json, os, sys, time
+root = os.path.abspath(sys.argv[2])
+opened = []
+def audit(event, args):
+    if event == "open" and isinstance(args[0], str):
+        path = os.path.abspath(args[0])
+        if path.startswith(root + os.sep) and not path.endswith((".py", ".pyc")):
+            opened.append(os.path.relpath(path, root))
+before = set(sys.modules)
+sys.addaudithook(audit)
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+loaded = sorted(set(sys.modules) - before)
+print(json.dumps(dict(seconds = elapsed, modules = loaded, opened = opened)))
+"""
+
+
+# import one module in a fresh interpreter, returning the probe's report
+def probe(module) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, module, ROOT], cwd = ROOT, capture_output = True,
+        text = True, check = True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# time each module's import, keeping the fastest of `repeat` fresh imports
+def run(modules = MODULES, repeat = 5) -> list:
+    results = []
+    for module in modules:
+        reports = [probe(module) for _ in range(repeat)]
+        best = min(reports, key = lambda report: report["seconds"])
+        heavy = sorted({name.split(".")[0] for name in best["modules"]}
+                       & set(FORBIDDEN))
+        results.append(dict(
+            module = module,
+            seconds = best["seconds"],
+            modules_loaded = len(best["modules"]),
+            forbidden = heavy,
+            opened = best["opened"]
+        ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time imports of the sampling engine")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--json", help = "also write the results to this file")
+    parser.add_argument("modules", nargs = "*", default = MODULES)
+    args = parser.parse_args()
+
+    results = run(args.modules, args.repeat)
+    failed = False
+    print(f"{'module':<16}{'ms':>9}{'modules':>9}  problems")
+    for result in results:
+        problems = [f"loads {name}" for name in result["forbidden"]]
+        problems += [f"opens {path}" for path in result["opened"]]
+        failed = failed or bool(problems)
+        print(f"{result['module']:<16}{result['seconds'] * 1000:>9.1f}"
+              f"{result['modules_loaded']:>9}  {', '.join(problems)}")
+
+    if args.json:
+        with open(args.json, "w") as output_file:
+            json.dump(results, output_file, indent = 2)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,327 @@
+import math
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from partition import Partition, IndexedSet, check_contiguous
+from moves import MoveGenerator
+from scoring import ScoreEngine
+from trajectory import TrajectoryWriter
+from fliplog import FlipLogWriter
+from checkpoint import write_checkpoint, read_checkpoint
+from profiling import ChainProfiler, JsonLinesSink
+from streams import RandomStream, spawn_seeds
+
+
+"""
+MarkovChain class
+One redistricting chain, using the same acceptance rule as the notebook's
+Modified_one_iteration_of_MCMC_colorado:
+
+    transition probability = min(1, con1 / con2, exp(-beta * (new - old)))
+
+where con1 / con2 is the ratio of legal moves before and after the proposal.
+Everything is updated in place on a Partition, so a step never copies the
+graph or rescans the districts.
+
+The starting plan must be contiguous (every district connected and
+non-empty), otherwise a ValueError is raised. A step raises a RuntimeError if
+the plan has no legal move at all, e.g. when there is a single district.
+
+move_generator is the class that draws moves: MoveGenerator (exact legal move
+counts), moves.CutEdgeMoveGenerator (cut edge counts, for very large maps) or
+recom.ReCom (spanning-tree recombination of two districts). A ReCom step moves
+many nodes, so step() then returns arrays of nodes and districts.
+
+Each chain draws from its own streams.RandomStream (a numpy Generator read
+in blocks), so chains never share random state.
+
+With a profiling.ChainProfiler, every step is timed stage by stage and
+reported to the profiler's sinks. Both paths run the same _step, and without
+a profiler it only pays for a few checks that there is none.
+"""
+class MarkovChain:
+
+    def __init__(self, partition, beta = 0.05, lambda_J = 1, c_pop = 0.3,
+                 c_pvi = 0.00003, rng = None, move_generator = MoveGenerator,
+                 profiler = None):
+        check_contiguous(partition)
+        self.partition = partition
+        self.beta = beta
+        self.move_generator = move_generator
+        self.moves = move_generator(partition)
+        self.scorer = ScoreEngine(partition, lambda_J, c_pop, c_pvi)
+        self.rng = rng if rng is not None else RandomStream()
+        self.score = self.scorer.score()
+        self.step_count = 0
+        self.accepted_count = 0
+        self.profiler = profiler
+
+
+    # perform a single iteration of MCMC sampling
+    # returns (node, old_district, new_district, accepted)
+    def step(self) -> tuple:
+        profiler = self.profiler
+        if profiler is None:
+            return self._step()
+
+        profiler.start()
+        marks = []
+        move = self._step(marks, profiler.clock)
+        profiler.record(dict(
+            step = self.step_count,
+            accepted = move[3],
+            retries = getattr(self.moves, "retries", 0),
+            proposal = marks[1] - marks[0],
+            scoring = marks[2] - marks[1],
+            apply = marks[3] - marks[2],
+            acceptance = marks[4] - marks[3]
+        ))
+        return move
+
+
+    # the step itself; with a list of marks, clock() is appended to it at the
+    # start of each stage and at the end (see profiling.STAGES)
+    def _step(self, marks = None, clock = None) -> tuple:
+        if marks is not None:
+            marks.append(clock())
+        move = self.moves.random_move(self.rng)
+        if move is None:
+            raise RuntimeError("no legal move exists from the current plan")
+        node, district = move
+        if marks is not None:
+            marks.append(clock())
+        if isinstance(node, np.ndarray):
+            old = self.partition.assignment[node]
+            delta = self.scorer.move_delta(node, district)
+        else:
+            old = int(self.partition.assignment[node])
+            delta = self.scorer.flip_delta(node, district)
+        if marks is not None:
+            marks.append(clock())
+        proposal_ratio = self.moves.propose(node, district)
+        if marks is not None:
+            marks.append(clock())
+
+        # exp(-beta * delta) is at least 1 whenever the score does not go up
+        exponent = -self.beta * delta
+        score_ratio = 1.0 if exponent >= 0 else math.exp(exponent)
+        transition_probability = min(1.0, proposal_ratio, score_ratio)
+
+        accepted = self.rng.random() < transition_probability
+        if accepted:
+            self.moves.accept()
+            self.score += delta
+            self.accepted_count += 1
+        else:
+            self.moves.reject()
+        if marks is not None:
+            marks.append(clock())
+
+        self.step_count += 1
+        return node, old, district, accepted
+
+
+    # everything needed to continue this chain exactly where it is
+    def get_state(self) -> dict:
+        scorer = self.scorer
+        return dict(
+            assignment = self.partition.assignment.copy(),
+            num_districts = self.partition.num_districts,
+            cut_edges = list(self.partition.cut_edges),
+            move_generator = self.move_generator,
+            moves = list(self.moves.moves) if hasattr(self.moves, "moves") else None,
+            beta = self.beta,
+            lambda_J = scorer.lambda_J,
+            c_pop = scorer.c_pop,
+            c_pvi = scorer.c_pvi,
+            score = self.score,
+            step_count = self.step_count,
+            accepted_count = self.accepted_count,
+            rng_state = self.rng.getstate()
+        )
+
+
+    # rebuild a chain from get_state on the same graph
+    @classmethod
+    def from_state(cls, graph, state):
+        partition = Partition(graph, state["assignment"], state["num_districts"])
+        chain = cls(partition, state["beta"], state["lambda_J"], state["c_pop"],
+                    state["c_pvi"], move_generator = state["move_generator"])
+
+        # the order of these sets decides which move a random draw picks
+        partition.cut_edges = IndexedSet(state["cut_edges"])
+        if state["moves"] is not None:
+            chain.moves.moves = IndexedSet(state["moves"])
+
+        chain.rng.setstate(state["rng_state"])
+        chain.score = state["score"]
+        chain.step_count = state["step_count"]
+        chain.accepted_count = state["accepted_count"]
+        return chain
+
+
+    # run n_steps iterations, returning the score and acceptance of each step
+    # after every step, observer.observe(chain, move, accepted) is called for
+    # each observer, e.g. a trajectory.TrajectoryWriter
+    def run(self, n_steps, observers = ()) -> tuple:
+        scores = np.empty(n_steps)
+        accepted = np.empty(n_steps, dtype = bool)
+        for i in range(n_steps):
+            move = self.step()
+            accepted[i] = move[3]
+            scores[i] = self.score
+            for observer in observers:
+                observer.observe(self, move, move[3])
+        return scores, accepted
+
+
+# turn a plan into an assignment vector
+# a plan is either an assignment (one district per node) or a list of districts,
+# each a list of nodes or a subgraph, like the notebook's subgraph_nodes_list
+def plan_to_assignment(graph, plan):
+    if len(plan) == len(graph.nodes) and all(np.isscalar(x) for x in plan):
+        return np.asarray(plan, dtype = np.int64)
+    return Partition.from_subgraphs(graph, plan).assignment
+
+
+"""
+run_chain function
+Runs a single chain from a plan. It is module level so worker processes can
+call it. Keyword arguments beta, lambda_J, c_pop, c_pvi and move_generator go
+to MarkovChain.
+
+With profile_path, every step is profiled (see profiling.py) and one summary
+per profile_every steps is appended to profile_path as JSON lines.
+
+With trajectory_path, every step is also streamed to disk (see trajectory.py).
+With flip_log_path, every step is recorded in a flip log (see fliplog.py).
+
+With checkpoint_path, the chain's full state (plan, legal moves, random state,
+step counter and statistics) is saved every checkpoint_every steps. If the
+checkpoint already exists the chain resumes from it instead of starting over,
+and continues exactly as if it had never stopped; n_steps is the total length
+of the chain, so only the remaining steps are run. The returned scores and
+acceptance flags only cover the steps run by this call, and the trajectory and
+flip log are cut back to the checkpoint before appending to them.
+"""
+def run_chain(graph, plan, n_steps, seed = None, beta = 0.05, lambda_J = 1,
+              c_pop = 0.3, c_pvi = 0.00003, trajectory_path = None,
+              flip_log_path = None, checkpoint_path = None,
+              checkpoint_every = 10000, move_generator = MoveGenerator,
+              profile_path = None, profile_every = 1000) -> dict:
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        chain = MarkovChain.from_state(graph, read_checkpoint(checkpoint_path))
+    else:
+        partition = Partition(graph, plan_to_assignment(graph, plan))
+        chain = MarkovChain(partition, beta, lambda_J, c_pop, c_pvi,
+                            rng = RandomStream(seed), move_generator = move_generator)
+    partition = chain.partition
+    if profile_path is not None:
+        chain.profiler = ChainProfiler([JsonLinesSink(profile_path, profile_every)])
+
+    observers = []
+    if trajectory_path is not None:
+        observers.append(TrajectoryWriter(trajectory_path, len(partition.nodes),
+                                          partition.num_districts))
+    if flip_log_path is not None:
+        observers.append(FlipLogWriter(flip_log_path, partition.assignment))
+    for writer in observers:
+        writer.truncate(chain.step_count)
+
+    remaining = n_steps - chain.step_count
+    segment = remaining if checkpoint_path is None else checkpoint_every
+    scores = []
+    accepted = []
+    try:
+        while remaining > 0:
+            segment_scores, segment_accepted = chain.run(min(segment, remaining), observers)
+            scores.append(segment_scores)
+            accepted.append(segment_accepted)
+            remaining -= len(segment_scores)
+
+            # the output must be on disk before the checkpoint says it is
+            if checkpoint_path is not None:
+                for writer in observers:
+                    writer.flush()
+                write_checkpoint(checkpoint_path, chain.get_state())
+    finally:
+        for writer in observers:
+            writer.close()
+        if chain.profiler is not None:
+            chain.profiler.close()
+
+    return dict(
+        scores = np.concatenate(scores) if scores else np.empty(0),
+        accepted = np.concatenate(accepted) if accepted else np.empty(0, dtype = bool),
+        assignment = partition.assignment.copy()
+    )
+
+
+"""
+run_ensemble function
+Inputs: graph:         networkx graph or csr_graph.CSRGraph, e.g. from
+                       get_colorado_graph
+        initial_plans: list of starting plans; chain i starts from
+                       initial_plans[i % len(initial_plans)]
+        n_chains:      number of independent chains
+        n_steps:       number of MCMC iterations per chain
+        workers:       number of worker processes (default: every core),
+                       workers = 1 runs the chains in this process
+        seed:          master seed; chain i gets the i-th seed spawned from it
+                       (see streams.py), so the results do not depend on the
+                       number of workers
+        trajectory_dir: if given, chain i streams its steps to
+                       <trajectory_dir>/chain_<i> (see trajectory.py)
+        flip_log_dir:  if given, chain i records a flip log in
+                       <flip_log_dir>/chain_<i> (see fliplog.py)
+        profile_dir:   if given, chain i writes profiling summaries to
+                       <profile_dir>/chain_<i>.jsonl (see profiling.py)
+        remaining keyword arguments are passed on to MarkovChain
+Output: Dictionary of merged results, ordered by chain
+            scores:      (n_chains, n_steps) array of scores after each step
+            accepted:    (n_chains, n_steps) array of acceptance flags
+            assignments: (n_chains, number of nodes) array of final plans
+            seeds:       numpy SeedSequence of each chain
+"""
+def run_ensemble(graph, initial_plans, n_chains, n_steps, workers = None,
+                 seed = 46, trajectory_dir = None, flip_log_dir = None,
+                 profile_dir = None, **chain_args) -> dict:
+    if not initial_plans:
+        raise ValueError("at least one initial plan is required")
+
+    plans = [initial_plans[i % len(initial_plans)] for i in range(n_chains)]
+    seeds = spawn_seeds(seed, n_chains)
+    outputs = [
+        dict(
+            trajectory_path = None if trajectory_dir is None
+                else os.path.join(trajectory_dir, f"chain_{i}"),
+            flip_log_path = None if flip_log_dir is None
+                else os.path.join(flip_log_dir, f"chain_{i}"),
+            profile_path = None if profile_dir is None
+                else os.path.join(profile_dir, f"chain_{i}.jsonl")
+        )
+        for i in range(n_chains)
+    ]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1 or n_chains == 1:
+        results = [run_chain(graph, plans[i], n_steps, seeds[i],
+                             **outputs[i], **chain_args)
+                   for i in range(n_chains)]
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, n_chains)) as pool:
+            futures = [
+                pool.submit(run_chain, graph, plans[i], n_steps, seeds[i],
+                            **outputs[i], **chain_args)
+                for i in range(n_chains)
+            ]
+            results = [future.result() for future in futures]
+
+    return dict(
+        scores = np.stack([r["scores"] for r in results]),
+        accepted = np.stack([r["accepted"] for r in results]),
+        assignments = np.stack([r["assignment"] for r in results]),
+        seeds = seeds
+    )
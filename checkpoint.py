@@ -0,0 +1,38 @@
+import os
+import pickle
+
+
+"""
+Checkpoint files
+A checkpoint is the dictionary returned by MarkovChain.get_state, pickled to
+disk. It is written to a temporary file that is flushed to disk and then
+renamed over the old checkpoint, so a chain killed mid-write always leaves
+either the previous checkpoint or the new one behind, never half of one.
+"""
+
+# bump when the layout of the saved state changes
+CHECKPOINT_VERSION = 4
+
+
+# atomically write a chain state to path
+def write_checkpoint(path, state):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok = True)
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as output_file:
+        pickle.dump(dict(version = CHECKPOINT_VERSION, state = state), output_file,
+                    protocol = pickle.HIGHEST_PROTOCOL)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    os.replace(temp_path, path)
+
+
+# read a chain state written by write_checkpoint
+def read_checkpoint(path) -> dict:
+    with open(path, "rb") as input_file:
+        data = pickle.load(input_file)
+
+    if data.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} was written by an incompatible version")
+    return data["state"]
@@ -0,0 +1,177 @@
+import numpy as np
+import networkx as nx
+from generate_data import get_compiled_colorado_graph, GRAPH_CACHE_PATH
+
+
+"""
+CSRGraph class
+A read-only graph stored as flat arrays instead of networkx dicts, for maps
+with far more nodes than Colorado's 64 counties (e.g. 100k+ precincts).
+
+Nodes are numbered 0 .. n - 1. The neighbors of node u are
+indices[indptr[u]:indptr[u + 1]], and every edge appears once in each
+direction. Node attributes are contiguous arrays, one entry per node:
+
+    population:   population of each node
+    pvi:          partisan lean (the networkx graph's "PVI" attribute)
+    democrats:    registered Democrats (zeros if unknown)
+    republicans:  registered Republicans (zeros if unknown)
+    names:        node names, or None
+
+Partition, ScoreEngine, MoveGenerator and MarkovChain accept a CSRGraph
+anywhere they accept a networkx graph. The arrays may be memory-mapped (see
+get_colorado_csr_graph), so loading a graph does not parse or copy anything.
+"""
+class CSRGraph:
+
+    def __init__(self, indptr, indices, population, pvi, democrats = None,
+                 republicans = None, names = None):
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        n = len(self.indptr) - 1
+        if n < 0 or self.indptr[-1] != len(self.indices):
+            raise ValueError("indptr and indices do not describe a CSR adjacency")
+
+        self.population = np.asarray(population, dtype = np.int64)
+        self.pvi = np.asarray(pvi, dtype = np.int64)
+        self.democrats = (np.zeros(n, dtype = np.int64) if democrats is None
+                          else np.asarray(democrats, dtype = np.int64))
+        self.republicans = (np.zeros(n, dtype = np.int64) if republicans is None
+                            else np.asarray(republicans, dtype = np.int64))
+        self.names = names
+        for attribute in (self.population, self.pvi, self.democrats, self.republicans):
+            if attribute.shape != (n,):
+                raise ValueError("every node attribute needs one entry per node")
+
+        # built on first use, see neighbor_lists and to_networkx
+        self._neighbor_lists = None
+        self._networkx = None
+
+
+    # build from a list of undirected edges (u, v), each given once
+    # neighbors are ordered by node number
+    @classmethod
+    def from_edges(cls, num_nodes, edges, population, pvi, **attributes):
+        edges = np.asarray(edges, dtype = np.int64).reshape(-1, 2)
+        rows = np.concatenate([edges[:, 0], edges[:, 1]])
+        cols = np.concatenate([edges[:, 1], edges[:, 0]])
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(num_nodes + 1, dtype = np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength = num_nodes))
+        return cls(indptr, cols[order], population, pvi, **attributes)
+
+
+    # copy a networkx graph with "population" and "PVI" node attributes
+    # nodes are renumbered by their position in graph.nodes, and each node's
+    # neighbors keep the order of graph.adj, so chains behave identically
+    @classmethod
+    def from_networkx(cls, graph):
+        nodes = list(graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        graph_nodes = graph.nodes
+
+        indptr = np.zeros(len(nodes) + 1, dtype = np.int64)
+        indptr[1:] = np.cumsum([len(graph.adj[u]) for u in nodes])
+        indices = np.array([index[v] for u in nodes for v in graph.adj[u]],
+                           dtype = np.int64)
+
+        def attribute(key):
+            return [graph_nodes[u].get(key, 0) for u in nodes]
+
+        names = None
+        if all("name" in graph_nodes[u] for u in nodes):
+            names = np.array([graph_nodes[u]["name"] for u in nodes])
+
+        return cls(indptr, indices, attribute("population"), attribute("PVI"),
+                   attribute("democrats"), attribute("republicans"), names)
+
+
+    # build from the dictionary of arrays returned by get_compiled_colorado_graph
+    @classmethod
+    def from_compiled(cls, arrays):
+        return cls(arrays["indptr"], arrays["indices"], arrays["population"],
+                   arrays["PVI"], arrays["democrats"], arrays["republicans"],
+                   arrays["name"])
+
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    # nodes are just their own numbers, so graph.nodes[i] == i
+    @property
+    def nodes(self):
+        return range(len(self))
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def degree(self, node) -> int:
+        return int(self.indptr[node + 1] - self.indptr[node])
+
+    # neighbors of one node, as an array
+    def neighbors(self, node) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+
+    # every edge once, as (u, v) with u < v, in CSR order
+    def edges(self) -> np.ndarray:
+        rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        keep = rows < self.indices
+        return np.column_stack([rows[keep], self.indices[keep]])
+
+
+    # neighbors of every node as Python lists, which is what the chain's inner
+    # loops iterate over; built once and shared by every Partition on the graph
+    def neighbor_lists(self) -> list:
+        if self._neighbor_lists is None:
+            flat = self.indices.tolist()
+            bounds = self.indptr.tolist()
+            self._neighbor_lists = [
+                flat[bounds[u]:bounds[u + 1]] for u in range(len(self))
+            ]
+        return self._neighbor_lists
+
+
+    # equivalent networkx graph, with the same attributes as get_colorado_graph
+    def to_networkx(self):
+        if self._networkx is None:
+            graph = nx.Graph()
+            population = self.population.tolist()
+            pvi = self.pvi.tolist()
+            for u in range(len(self)):
+                graph.add_node(u, population = population[u], PVI = pvi[u])
+                if self.names is not None:
+                    graph.nodes[u]["name"] = str(self.names[u])
+            bounds = self.indptr.tolist()
+            flat = self.indices.tolist()
+            graph.add_edges_from(
+                (u, flat[k]) for u in range(len(self)) for k in range(bounds[u], bounds[u + 1])
+            )
+            self._networkx = graph
+        return self._networkx
+
+
+    # networkx subgraph on the given nodes, used by Partition.to_subgraphs
+    def subgraph(self, nodes):
+        return self.to_networkx().subgraph(nodes)
+
+
+    # caches are rebuilt rather than sent to worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_neighbor_lists"] = None
+        state["_networkx"] = None
+        return state
+
+
+"""
+get_colorado_csr_graph function
+INPUT:  edge_path, node_path: the source CSV files
+        cache_path:           compiled graph cache (see generate_data)
+OUTPUT: CSRGraph of Colorado, memory-mapped from the compiled graph cache
+"""
+def get_colorado_csr_graph(edge_path = "county.csv", node_path = "data_by_county.csv",
+                           cache_path = GRAPH_CACHE_PATH):
+    arrays = get_compiled_colorado_graph(edge_path, node_path, cache_path)
+    return CSRGraph.from_compiled(arrays)
@@ -0,0 +1,323 @@
+import os
+import numpy as np
+from partition import Partition
+from chain import MarkovChain, plan_to_assignment
+from tempering import ReplicaGroup
+from streams import spawn_streams
+
+
+# per-step quantities tracked by the diagnostics, see chain_statistics
+STATISTICS = ("score", "cut_edges", "population_deviation", "pvi_imbalance")
+
+
+# current value of every quantity in STATISTICS:
+#   score:                the chain's total score
+#   cut_edges:            number of edges joining two districts
+#   population_deviation: largest |district population - average| / average
+#   pvi_imbalance:        sum over districts of |PVI*population|, per person
+def chain_statistics(chain) -> tuple:
+    partition = chain.partition
+    average = chain.scorer.district_average
+    deviation = np.abs(partition.district_population - average).max() / average
+    imbalance = np.abs(partition.district_pvi).sum() / (average * partition.num_districts)
+    return chain.score, partition.cut_edge_count, deviation, imbalance
+
+
+"""
+StatisticsRecorder class
+Observer for MarkovChain.run that records chain_statistics after every step
+into a (steps, len(STATISTICS)) array.
+"""
+class StatisticsRecorder:
+
+    def __init__(self, n_steps):
+        self.values = np.empty((n_steps, len(STATISTICS)))
+        self.step = 0
+
+    def observe(self, chain, move, accepted):
+        self.values[self.step] = chain_statistics(chain)
+        self.step += 1
+
+
+# run a chain for n_steps, returning (scores, accepted, statistics)
+# module level so it can be sent to replica worker processes
+def run_tracked(chain, n_steps) -> tuple:
+    recorder = StatisticsRecorder(n_steps)
+    scores, accepted = chain.run(n_steps, [recorder])
+    return scores, accepted, recorder.values
+
+
+# autocovariance of each row of x at every lag, divided by n, using an FFT
+def autocovariance(x) -> np.ndarray:
+    x = np.asarray(x, dtype = float)
+    n = x.shape[-1]
+    centered = x - x.mean(axis = -1, keepdims = True)
+    size = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(centered, size)
+    return np.fft.irfft(spectrum * np.conj(spectrum), size)[..., :n] / n
+
+
+# autocorrelation of a single series at lags 0 .. max_lag
+def autocorrelation(x, max_lag = None) -> np.ndarray:
+    acov = autocovariance(x)
+    if max_lag is not None:
+        acov = acov[..., :max_lag + 1]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return acov / acov[..., :1]
+
+
+# split every chain into its first and second half
+def split_chains(chains) -> np.ndarray:
+    chains = np.asarray(chains, dtype = float)
+    if chains.ndim == 1:
+        chains = chains[None, :]
+    half = chains.shape[1] // 2
+    return np.concatenate([chains[:, :half], chains[:, chains.shape[1] - half:]])
+
+
+"""
+split_rhat function
+Input:  (chains, steps) array of one quantity
+Output: split-R-hat, which approaches 1 as the chains agree with each other
+        and with themselves over time; nan if every value is identical
+
+Each chain is split in half, and the variance between the halves is compared
+with the variance within them (Gelman et al., Bayesian Data Analysis).
+"""
+def split_rhat(chains) -> float:
+    chains = split_chains(chains)
+    m, n = chains.shape
+    if n < 2:
+        return np.nan
+    within = chains.var(axis = 1, ddof = 1).mean()
+    between = n * chains.mean(axis = 1).var(ddof = 1)
+    if within == 0:
+        return np.nan
+    var_plus = (n - 1) / n * within + between / n
+    return float(np.sqrt(var_plus / within))
+
+
+"""
+effective_sample_size function
+Input:  (chains, steps) array of one quantity
+Output: effective sample size over all chains; nan if every value is identical
+
+Uses the split chains and combines their autocorrelations with the
+between-chain variance, summing them in pairs until a pair turns negative and
+forcing the pair sums to decrease (Geyer's initial monotone sequence), as in
+Stan.
+"""
+def effective_sample_size(chains) -> float:
+    chains = split_chains(chains)
+    m, n = chains.shape
+    if n < 4:
+        return np.nan
+
+    acov = autocovariance(chains).mean(axis = 0)
+    mean_var = acov[0] * n / (n - 1)
+    var_plus = mean_var * (n - 1) / n
+    if m > 1:
+        var_plus += chains.mean(axis = 1).var(ddof = 1)
+    if var_plus == 0:
+        return np.nan
+    rho = 1 - (mean_var - acov) / var_plus
+    rho[0] = 1.0
+
+    # sums of consecutive pairs of autocorrelations, kept while positive
+    pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis = 1)
+    negative = np.flatnonzero(pairs <= 0)
+    pairs = pairs[:negative[0] if len(negative) else len(pairs)]
+    pairs = np.minimum.accumulate(pairs)
+
+    tau = max(-1 + 2 * pairs.sum(), 1 / np.log10(m * n))
+    return float(m * n / tau)
+
+
+"""
+ConvergenceMonitor class
+Collects the per-step statistics of several chains as they are sampled and
+reports their convergence diagnostics.
+
+    monitor.update(statistics)   append a (chains, steps, len(STATISTICS)) block
+    monitor.diagnostics()        {name: {"ess", "rhat", "tau"}} for each statistic
+    monitor.converged(...)       True once every statistic has reached the
+                                 target ESS and its split-R-hat is low enough
+
+The statistics are kept in one buffer that doubles in size when it fills up,
+so an update only copies the new block.
+
+tau is the integrated autocorrelation time: the number of steps per
+effectively independent sample.
+"""
+class ConvergenceMonitor:
+
+    def __init__(self, n_chains, names = STATISTICS):
+        self.names = names
+        self.buffer = np.empty((n_chains, 1024, len(names)))
+        self.steps = 0
+
+    def update(self, statistics):
+        statistics = np.asarray(statistics, dtype = float)
+        steps = self.steps + statistics.shape[1]
+        if steps > self.buffer.shape[1]:
+            capacity = max(steps, 2 * self.buffer.shape[1])
+            buffer = np.empty((len(self.buffer), capacity, len(self.names)))
+            buffer[:, :self.steps] = self.buffer[:, :self.steps]
+            self.buffer = buffer
+        self.buffer[:, self.steps:steps] = statistics
+        self.steps = steps
+
+    # (chains, steps, statistics) view of everything seen so far
+    def history(self) -> np.ndarray:
+        return self.buffer[:, :self.steps]
+
+    def diagnostics(self) -> dict:
+        history = self.history()
+        result = {}
+        for s, name in enumerate(self.names):
+            ess = effective_sample_size(history[:, :, s])
+            result[name] = dict(
+                ess = ess,
+                rhat = split_rhat(history[:, :, s]),
+                tau = history.shape[0] * history.shape[1] / ess
+            )
+        return result
+
+    # nan means a statistic never changed, which is never counted as converged
+    def converged(self, target_ess, max_rhat = 1.01, diagnostics = None) -> bool:
+        if diagnostics is None:
+            diagnostics = self.diagnostics()
+        return all(d["ess"] >= target_ess and d["rhat"] <= max_rhat
+                   for d in diagnostics.values())
+
+
+"""
+run_until_converged function
+Runs several chains side by side until every tracked statistic (score, cut
+edges, population deviation and PVI imbalance) has an effective sample size
+of at least target_ess and a split-R-hat of at most max_rhat.
+
+Inputs: graph:         networkx graph or csr_graph.CSRGraph, e.g. from
+                       get_colorado_graph
+        initial_plans: list of starting plans; chain i starts from
+                       initial_plans[i % len(initial_plans)]
+        n_chains:      number of chains (at least 2 is recommended, so R-hat
+                       can compare chains with each other)
+        target_ess:    effective sample size to reach for every statistic
+        max_rhat:      largest acceptable split-R-hat
+        check_every:   steps sampled between chances to check for convergence
+        check_growth:  after a check, wait until the recorded steps have
+                       grown by this fraction before checking again (so a
+                       long run is checked O(log steps) times rather than
+                       steps / check_every times)
+        min_steps:     never stop before this many recorded steps
+        max_steps:     stop here even if the chains have not converged
+        burn_in:       steps run first and left out of the diagnostics
+        workers:       number of worker processes (default: every core),
+                       workers = 1 runs every chain in this process
+        seed:          master seed; chain i gets the i-th stream spawned from
+                       it (see streams.py)
+        remaining keyword arguments are passed on to MarkovChain
+Output: Dictionary of results
+            converged:   whether the targets were reached before max_steps
+            steps:       number of recorded steps per chain
+            scores:      (n_chains, steps) scores after each recorded step
+            accepted:    (n_chains, steps) acceptance flags
+            statistics:  (n_chains, steps, len(STATISTICS)) tracked statistics
+            diagnostics: final ESS, split-R-hat and tau of each statistic
+            history:     list of (steps, smallest ESS, largest R-hat) per check
+            assignments: (n_chains, number of nodes) final plans
+
+Each check recomputes the diagnostics over the whole history, which costs
+O(steps log steps), so checks are spaced out geometrically by check_growth.
+Chains only stop at multiples of check_every. Which of those are checked
+depends only on the step count, and chain i always gets the same stream, so
+the results do not depend on the number of workers. They do depend on
+check_every and check_growth, which decide where a run may stop.
+"""
+def run_until_converged(graph, initial_plans, n_chains = 4, target_ess = 1000,
+                        max_rhat = 1.01, check_every = 1000, check_growth = 0.1,
+                        min_steps = 0, max_steps = 1000000, burn_in = 0,
+                        workers = None, seed = 46, **chain_args) -> dict:
+    if not initial_plans:
+        raise ValueError("at least one initial plan is required")
+    if check_every < 1 or max_steps < 1:
+        raise ValueError("check_every and max_steps must be positive")
+    if check_growth < 0:
+        raise ValueError("check_growth must not be negative")
+
+    streams = spawn_streams(seed, n_chains)
+    chains = [
+        MarkovChain(Partition(graph, plan_to_assignment(
+                        graph, initial_plans[i % len(initial_plans)])),
+                    rng = streams[i], **chain_args)
+        for i in range(n_chains)
+    ]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, n_chains))
+    groups = [
+        ReplicaGroup({i: chains[i] for i in range(w, n_chains, workers)}, workers > 1)
+        for w in range(workers)
+    ]
+
+    # ask every group to do something, returning the answers in chain order
+    def broadcast(command, argument = None) -> list:
+        for group in groups:
+            group.send(command, argument)
+        answers = {}
+        for group in groups:
+            answers.update(group.receive())
+        return [answers[i] for i in range(n_chains)]
+
+    monitor = ConvergenceMonitor(n_chains)
+    scores = [[] for _ in range(n_chains)]
+    accepted = [[] for _ in range(n_chains)]
+    history = []
+    diagnostics = {}
+    converged = False
+    next_check = max(min_steps, check_every)
+
+    try:
+        if burn_in > 0:
+            broadcast("run", burn_in)
+
+        while monitor.steps < max_steps:
+            length = min(check_every, max_steps - monitor.steps)
+            results = broadcast("call", (run_tracked, (length,)))
+            for i, (chain_scores, chain_accepted, _) in enumerate(results):
+                scores[i].append(chain_scores)
+                accepted[i].append(chain_accepted)
+            monitor.update([statistics for _, _, statistics in results])
+            if monitor.steps < next_check and monitor.steps < max_steps:
+                continue
+            next_check = max(monitor.steps + check_every,
+                             int(monitor.steps * (1 + check_growth)))
+
+            diagnostics = monitor.diagnostics()
+            history.append((
+                monitor.steps,
+                float(np.min([d["ess"] for d in diagnostics.values()])),
+                float(np.max([d["rhat"] for d in diagnostics.values()]))
+            ))
+            if monitor.steps >= min_steps and monitor.converged(
+                    target_ess, max_rhat, diagnostics):
+                converged = True
+                break
+
+        assignments = broadcast("assignments")
+    finally:
+        for group in groups:
+            group.stop()
+
+    return dict(
+        converged = converged,
+        steps = monitor.steps,
+        scores = np.stack([np.concatenate(s) for s in scores]),
+        accepted = np.stack([np.concatenate(a) for a in accepted]),
+        statistics = monitor.history().copy(),
+        diagnostics = diagnostics,
+        history = history,
+        assignments = np.stack(assignments)
+    )
@@ -0,0 +1,222 @@
+import json
+import os
+import numpy as np
+from trajectory import write_json_atomic
+
+
+"""
+Flip logs
+Each step of a single-node flip chain moves at most one node, so instead of
+storing every plan (or rendering it to frames/), a flip log stores one small
+record per step plus a full plan every keyframe_interval steps:
+
+    meta.json        number of valid records and keyframes, rewritten atomically
+    flips.bin        FLIP_DTYPE records, appended in step order
+    keyframes.bin    plans after 0, K, 2K, ... steps (K = keyframe_interval)
+
+The plan after any step is rebuilt from the nearest keyframe at or before it
+by replaying at most K - 1 accepted flips.
+"""
+
+FLIP_DTYPE = np.dtype([
+    ("step", np.int64),
+    ("node", np.int32),
+    ("from_district", np.int16),
+    ("to_district", np.int16),
+    ("accepted", np.bool_),
+    ("score", np.float64)
+])
+
+
+"""
+FlipLogWriter class
+Inputs: path:              directory for the flip log (created if needed);
+                           an existing log is appended to
+        initial_assignment: plan before the first step, stored as keyframe 0
+        keyframe_interval: steps between full-plan keyframes
+        buffer_size:       records buffered in memory between writes
+
+A writer can be passed to MarkovChain.run as an observer. Truncating it to 0
+steps starts the log over from initial_assignment, so a chain restarted from
+another plan never replays flips onto the old one.
+"""
+class FlipLogWriter:
+
+    def __init__(self, path, initial_assignment, keyframe_interval = 1000,
+                 buffer_size = 10000):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        initial_assignment = np.asarray(initial_assignment)
+        self.initial_assignment = initial_assignment
+        self.keyframe_interval = keyframe_interval
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                self.meta = json.load(meta_file)
+            if (self.meta["num_nodes"] != len(initial_assignment)
+                    or self.meta["keyframe_interval"] != keyframe_interval):
+                raise ValueError(f"{path} holds a flip log with a different layout")
+            self._cut_files()
+        else:
+            self._create()
+
+        self.keyframe_dtype = np.dtype(self.meta["keyframe_dtype"])
+        self.step = self.meta["flips"]
+        self.buffer = np.empty(buffer_size, dtype = FLIP_DTYPE)
+        self.buffered = 0
+        self.keyframes = []
+
+        if self.meta["keyframes"] == 0:
+            self.keyframes.append(initial_assignment.astype(self.keyframe_dtype))
+            self.flush()
+
+
+    # start an empty log for initial_assignment, emptying any existing files
+    # after meta.json says they hold nothing
+    def _create(self):
+        self.meta = dict(
+            num_nodes = len(self.initial_assignment),
+            keyframe_interval = self.keyframe_interval,
+            keyframe_dtype = np.min_scalar_type(int(self.initial_assignment.max())).str,
+            flips = 0,
+            keyframes = 0
+        )
+        write_json_atomic(os.path.join(self.path, "meta.json"), self.meta)
+        for name in ("flips.bin", "keyframes.bin"):
+            open(os.path.join(self.path, name), "wb").close()
+
+
+    # remove anything past the valid extent recorded in meta.json
+    def _cut_files(self):
+        keyframe_size = self.meta["num_nodes"] * np.dtype(self.meta["keyframe_dtype"]).itemsize
+        os.truncate(os.path.join(self.path, "flips.bin"),
+                    self.meta["flips"] * FLIP_DTYPE.itemsize)
+        os.truncate(os.path.join(self.path, "keyframes.bin"),
+                    self.meta["keyframes"] * keyframe_size)
+
+
+    # record one step of a chain; assignment is the plan after the step
+    def append(self, node, from_district, to_district, accepted, score, assignment):
+        self.buffer[self.buffered] = (self.step, node, from_district, to_district,
+                                      accepted, score)
+        self.buffered += 1
+        self.step += 1
+
+        if self.step % self.keyframe_interval == 0:
+            self.keyframes.append(np.asarray(assignment, dtype = self.keyframe_dtype))
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+
+    # observer hook used by MarkovChain.run
+    def observe(self, chain, move, accepted):
+        node, from_district, to_district, _ = move
+        if isinstance(node, np.ndarray):
+            raise ValueError("a flip log can only record single-node moves")
+        self.append(node, from_district, to_district, accepted, chain.score,
+                    chain.partition.assignment)
+
+
+    # append the buffered records and keyframes to disk
+    def flush(self):
+        if self.buffered == 0 and not self.keyframes:
+            return
+
+        with open(os.path.join(self.path, "flips.bin"), "ab") as flip_file:
+            self.buffer[:self.buffered].tofile(flip_file)
+        with open(os.path.join(self.path, "keyframes.bin"), "ab") as keyframe_file:
+            for keyframe in self.keyframes:
+                keyframe.tofile(keyframe_file)
+
+        # only now do the new records become part of the log
+        self.meta["flips"] += self.buffered
+        self.meta["keyframes"] += len(self.keyframes)
+        write_json_atomic(os.path.join(self.path, "meta.json"), self.meta)
+
+        self.buffered = 0
+        self.keyframes = []
+
+
+    # drop every record after the first `steps`, e.g. records written after
+    # the checkpoint a chain is resuming from
+    def truncate(self, steps):
+        self.flush()
+        if steps > self.meta["flips"]:
+            raise ValueError(f"{self.path} only holds {self.meta['flips']} steps")
+
+        # the log may have been started from another plan, so keyframe 0 is
+        # rewritten from this writer's initial plan
+        if steps == 0:
+            self._create()
+            self.keyframe_dtype = np.dtype(self.meta["keyframe_dtype"])
+            self.step = 0
+            self.keyframes.append(self.initial_assignment.astype(self.keyframe_dtype))
+            self.flush()
+            return
+
+        self.meta["flips"] = steps
+        self.meta["keyframes"] = steps // self.keyframe_interval + 1
+        write_json_atomic(os.path.join(self.path, "meta.json"), self.meta)
+        self._cut_files()
+        self.step = steps
+
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+"""
+FlipLogReader class
+Memory-maps a flip log written by FlipLogWriter.
+
+    reader.flips                 structured array of every step (FLIP_DTYPE)
+    reader.flips["score"]        score after each step
+    reader.assignment(step)      plan after `step` steps (0 = initial plan)
+"""
+class FlipLogReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+
+        self.keyframe_interval = self.meta["keyframe_interval"]
+        self.flips = self._map("flips.bin", FLIP_DTYPE, (self.meta["flips"],))
+        self.keyframes = self._map(
+            "keyframes.bin", np.dtype(self.meta["keyframe_dtype"]),
+            (self.meta["keyframes"], self.meta["num_nodes"])
+        )
+
+    # memory-map the valid part of one of the log's files
+    def _map(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.empty(shape, dtype = dtype)
+        return np.memmap(os.path.join(self.path, name), dtype = dtype, mode = "r",
+                         shape = shape)
+
+    def __len__(self):
+        return len(self.flips)
+
+
+    # plan after `step` steps, replayed from the nearest earlier keyframe
+    def assignment(self, step) -> np.ndarray:
+        if not 0 <= step <= len(self.flips):
+            raise IndexError(f"step {step} is outside the log")
+
+        keyframe = step // self.keyframe_interval
+        plan = np.array(self.keyframes[keyframe], dtype = np.int64)
+
+        flips = self.flips[keyframe * self.keyframe_interval:step]
+        flips = flips[flips["accepted"]][::-1]
+
+        # a node may move several times, and only its last move counts
+        _, last = np.unique(flips["node"], return_index = True)
+        plan[flips["node"][last]] = flips["to_district"][last]
+        return plan
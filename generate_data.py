@@ -1,10 +1,17 @@
 # tested on python 3.11.2
 import csv
+import hashlib
+import json
+import os
 import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
 import re
 
+# compiled graph cache, see get_compiled_colorado_graph
+GRAPH_CACHE_PATH = os.path.join(".cache", "colorado_graph.bin")
+GRAPH_CACHE_MAGIC = b"MCMCGRPH"
+GRAPH_CACHE_VERSION = 1
+
 """
 find_nodes function
 Input:  Filepath (string) that leads to county.csv
@@ -139,9 +146,42 @@ def find_population_and_leans(input_path: str, nums):
     """
     return (populations, partisan_leans)
 
+"""
+find_registered_voters function
+Inputs: input_path: Filepath (string) that leads to data_by_county.csv
+        nums:       Dictionary that maps county names to integer IDs
+Output: Dictionaries mapping county IDs to #Democrats and #Republicans
+"""
+def find_registered_voters(input_path: str, nums):
+
+    democrats = dict()
+    republicans = dict()
+
+    with open(input_path, "r") as input_file:
+
+        # skip the header
+        next(input_file, None)
+
+        for line in input_file:
+            try:
+                row = line.split(",")
+                county_id = nums[row[0]]
+                democrats[county_id] = int(row[3])
+                republicans[county_id] = int(row[4])
+
+            # if something broke, print what went wrong
+            except Exception as e:
+                print(str(e))
+
+    return (democrats, republicans)
+
+
 """
 get_colorado_graph function
-INPUT:  None
+INPUT:  edge_path:  Filepath (string) that leads to county.csv
+        node_path:  Filepath (string) that leads to data_by_county.csv
+        cache_path: compiled graph cache (see get_compiled_colorado_graph),
+                    or None to always parse the CSV files
 OUTPUT: networkX undirected graph containing all nodes and edges
         Each node represents a county and contains the following attributes:
             - name
@@ -149,7 +189,21 @@ OUTPUT: networkX undirected graph containing all nodes and edges
             - PVI
 
 """
-def get_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv"):
+def get_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv",
+                       cache_path = GRAPH_CACHE_PATH):
+    if cache_path is None:
+        return build_colorado_graph(edge_path, node_path)
+
+    compiled = get_compiled_colorado_graph(edge_path, node_path, cache_path)
+    return compiled_to_networkx(compiled)
+
+
+"""
+build_colorado_graph function
+Parses county.csv and data_by_county.csv into a networkX graph.
+Used by get_colorado_graph when there is no cache.
+"""
+def build_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv"):
     
     """
     STEP 1:
@@ -234,3 +288,167 @@ def get_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv
     Return the graph
     """
     return graph
+
+
+"""
+Compiled graph cache
+A single binary file holding the Colorado graph as arrays:
+
+    - 16 bytes:  b"MCMCGRPH" followed by the header length (little-endian uint64)
+    - header:    JSON with the source hash and the dtype, shape and offset of
+                 every array
+    - arrays:    raw array data, each starting on a 64 byte boundary
+
+Adjacency is stored in CSR form: the neighbors of node i are
+indices[indptr[i]:indptr[i + 1]], in the same order as graph.adj[i]. Every
+array can be memory-mapped straight from the file, so loading the graph does
+not parse anything.
+
+The cache stores the SHA-256 of both source CSVs and is rebuilt whenever
+either file's content changes.
+"""
+# hash of the source files' contents, which decides whether a cache is stale
+def source_hash(*paths) -> str:
+    digest = hashlib.sha256(str(GRAPH_CACHE_VERSION).encode())
+    for path in paths:
+        with open(path, "rb") as input_file:
+            digest.update(hashlib.sha256(input_file.read()).digest())
+    return digest.hexdigest()
+
+
+# parse the CSV files into the array form of the graph
+def compile_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv"):
+    graph = build_colorado_graph(edge_path, node_path)
+    nodes = list(graph.nodes)
+    nums = {graph.nodes[i]["name"]: i for i in nodes}
+    democrats, republicans = find_registered_voters(node_path, nums)
+
+    indptr = np.zeros(len(nodes) + 1, dtype = np.int64)
+    indptr[1:] = np.cumsum([len(graph.adj[i]) for i in nodes])
+    indices = np.array([v for i in nodes for v in graph.adj[i]], dtype = np.int64)
+
+    return dict(
+        indptr = indptr,
+        indices = indices,
+        name = np.array([graph.nodes[i]["name"] for i in nodes]),
+        population = np.array([graph.nodes[i]["population"] for i in nodes], dtype = np.int64),
+        PVI = np.array([graph.nodes[i]["PVI"] for i in nodes], dtype = np.int64),
+        democrats = np.array([democrats.get(i, 0) for i in nodes], dtype = np.int64),
+        republicans = np.array([republicans.get(i, 0) for i in nodes], dtype = np.int64)
+    )
+
+
+# write arrays (and the source hash) to a cache file, atomically
+def write_graph_cache(path, arrays, source):
+    header = dict(source_hash = source, arrays = {})
+    offset = 0
+    for key, array in arrays.items():
+        offset = -(-offset // 64) * 64
+        header["arrays"][key] = dict(dtype = array.dtype.str, shape = list(array.shape),
+                                     offset = offset)
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode()
+
+    # array offsets are relative to the first 64 byte boundary after the header
+    start = -(-(16 + len(header_bytes)) // 64) * 64
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as output_file:
+        output_file.write(GRAPH_CACHE_MAGIC)
+        output_file.write(len(header_bytes).to_bytes(8, "little"))
+        output_file.write(header_bytes)
+        for key, array in arrays.items():
+            output_file.seek(start + header["arrays"][key]["offset"])
+            output_file.write(np.ascontiguousarray(array).tobytes())
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    os.replace(temp_path, path)
+
+
+# memory-map every array in a cache file, returning (source hash, arrays)
+def read_graph_cache(path) -> tuple:
+    with open(path, "rb") as input_file:
+        if input_file.read(8) != GRAPH_CACHE_MAGIC:
+            raise ValueError(f"{path} is not a compiled graph cache")
+        header_length = int.from_bytes(input_file.read(8), "little")
+        header = json.loads(input_file.read(header_length))
+
+    start = -(-(16 + header_length) // 64) * 64
+    arrays = {}
+    for key, info in header["arrays"].items():
+        shape = tuple(info["shape"])
+        dtype = np.dtype(info["dtype"])
+        if 0 in shape:
+            arrays[key] = np.empty(shape, dtype = dtype)
+        else:
+            arrays[key] = np.memmap(path, dtype = dtype, mode = "r", shape = shape,
+                                    offset = start + info["offset"])
+    return header["source_hash"], arrays
+
+
+"""
+get_compiled_colorado_graph function
+INPUT:  edge_path, node_path: the source CSV files
+        cache_path:           compiled graph cache file
+OUTPUT: Dictionary of (memory-mapped) arrays:
+            indptr, indices:  CSR adjacency
+            name, population, PVI, democrats, republicans: one entry per node
+
+The cache is rebuilt only if it is missing or the CSVs' content has changed.
+"""
+def get_compiled_colorado_graph(edge_path = "county.csv", node_path = "data_by_county.csv",
+                                cache_path = GRAPH_CACHE_PATH):
+    source = source_hash(edge_path, node_path)
+    if os.path.exists(cache_path):
+        try:
+            cached_source, arrays = read_graph_cache(cache_path)
+            if cached_source == source:
+                return arrays
+        except (ValueError, KeyError, OSError):
+            pass
+
+    arrays = compile_colorado_graph(edge_path, node_path)
+    write_graph_cache(cache_path, arrays, source)
+    return read_graph_cache(cache_path)[1]
+
+
+# networkX view of the array form, identical to what build_colorado_graph returns
+def compiled_to_networkx(arrays):
+    names = arrays["name"].tolist()
+    population = arrays["population"].tolist()
+    pvi = arrays["PVI"].tolist()
+    indptr = arrays["indptr"].tolist()
+    indices = arrays["indices"].tolist()
+
+    graph = nx.Graph()
+    for i in range(len(names)):
+        graph.add_node(i, name = names[i], population = population[i], PVI = pvi[i])
+
+    # adding edges row by row reproduces the original neighbor order
+    graph.add_edges_from(
+        (i, indices[k]) for i in range(len(names)) for k in range(indptr[i], indptr[i + 1])
+    )
+    return graph
+
+
+"""
+get_colorado_districts function
+INPUT:  None
+OUTPUT: List of Colorado's current congressional districts, each a list of
+        county IDs (as numbered by get_colorado_graph)
+
+This is the starting plan used in TechnicalDemo.ipynb.
+"""
+def get_colorado_districts():
+    return [
+        [16],
+        [29, 54, 35, 25, 59, 10, 24, 6, 19],
+        [41, 52, 23, 39, 49, 15, 26, 43, 57, 46, 17, 56, 55, 27, 42, 33, 53, 3,
+         40, 1, 11, 12, 28, 51, 45, 36],
+        [9, 44, 38, 58, 48, 61, 63, 18, 21, 37, 32, 13, 31, 5, 50, 4],
+        [20],
+        [0, 2],
+        [30, 34, 47, 8, 22, 14, 60],
+        [7, 62]
+    ]
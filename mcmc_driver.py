@@ -1,21 +1,57 @@
 import networkx as nx
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import random
-import copy
-import plotly.graph_objects as go
-from IPython.display import display, HTML
-from generate_data import *
+from generate_data import get_colorado_graph
+from partition import flip_keeps_district_connected
+from streams import RandomStream
 
 # set a random seed
+# every random draw in this module comes from rng, its own stream, so
+# importing it leaves Python's and numpy's global random state alone
 seed_value=46
-random.seed(seed_value)
+rng = RandomStream(seed_value)
+
+
+# restart this module's random stream from a new seed
+def set_seed(value):
+    global rng
+    rng = RandomStream(value)
+
+
+"""
+Lazy module attributes
+Importing this module only loads numpy and networkx and reads no files, so
+worker processes that import it stay cheap. The Colorado graph (graph, n,
+graph_nodes) is built on first access, and the plotting and notebook modules
+(plt, animation, go, display, HTML) are imported on first access too.
+"""
+_LAZY_MODULES = {
+    "plt": ("matplotlib.pyplot", None),
+    "animation": ("matplotlib.animation", None),
+    "go": ("plotly.graph_objects", None),
+    "display": ("IPython.display", "display"),
+    "HTML": ("IPython.display", "HTML")
+}
+
+
+# PEP 562 hook, called only for names that are not already module globals
+def __getattr__(name):
+    if name in ("graph", "n", "graph_nodes"):
+        # generate colorado graph
+        graph = get_colorado_graph()
+        globals().update(graph = graph, n = len(graph.nodes), graph_nodes = graph.nodes)
+        return globals()[name]
+
+    if name in _LAZY_MODULES:
+        import importlib
+        module_name, attribute = _LAZY_MODULES[name]
+        value = importlib.import_module(module_name)
+        if attribute is not None:
+            value = getattr(value, attribute)
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# generate colorado graph
-graph = get_colorado_graph()
-n = len(graph.nodes)
-graph_nodes = graph.nodes
 
 # divide the colorado into subgraphs representing districts
 def divide_into_subgraphs(graph, n = 5) -> list:
@@ -71,11 +107,38 @@ def get_random_edge_between_subgraphs(graph, subgraphs) -> tuple:
 
     edges_between_subgraphs = get_edges_between_subgraphs(graph, subgraphs)
     if edges_between_subgraphs:
-        return random.choice(edges_between_subgraphs)
+        return rng.choice(edges_between_subgraphs)
     else:
         return None
 
 
+# randomly select an edge connecting two districts of a Partition
+# uses the partition's maintained cut-edge index instead of nx.edge_boundary
+def get_random_cut_edge(partition) -> tuple:
+    edge = partition.random_cut_edge(rng)
+    if edge is None:
+        return None
+    u, v = edge
+    return partition.nodes[u], partition.nodes[v]
+
+
+# check whether moving node_to_move out of its district keeps that district
+# contiguous and non-empty, searching only around the moved node instead of
+# running nx.is_connected over every district after the move
+def is_move_contiguous(partition, node_to_move) -> bool:
+    return flip_keeps_district_connected(partition, partition.index[node_to_move])
+
+
+# draw a valid move in one shot from a MoveGenerator, without the retry loop
+# returns (node_to_move, district), or None if no legal move exists
+def get_a_valid_move(moves) -> tuple:
+    move = moves.random_move(rng)
+    if move is None:
+        return None
+    node, district = move
+    return moves.partition.nodes[node], district
+
+
 # create a proposed map, creating updated subgraphs and border edges
 def create_proposed_state(graph, subgraphs, conflicted_edge):
     
@@ -83,15 +146,16 @@ def create_proposed_state(graph, subgraphs, conflicted_edge):
     # seed_value=46
     # random.seed(seed_value)
     
-    # Create deep copies of the graph and subgraphs
-    modified_graph = copy.deepcopy(graph)
+    # The graph itself is never modified, so only the subgraphs are copied.
+    # Use create_proposed_partition to avoid copying anything at all.
+    modified_graph = graph
     modified_subgraphs = [subgraph.copy() for subgraph in subgraphs]
 
     # Get the nodes connected by the conflicted edge
     node1, node2 = conflicted_edge
 
     # Choose one of the nodes randomly
-    node_to_move = random.choice([node1, node2])
+    node_to_move = rng.choice([node1, node2])
 
     # Find the index of the subgraph containing the node to move
     index_with_node = next((i for i, subgraph in enumerate(modified_subgraphs) 
@@ -116,6 +180,24 @@ def create_proposed_state(graph, subgraphs, conflicted_edge):
     return modified_graph, modified_subgraphs
 
 
+# propose the same move as create_proposed_state, applied in place to a Partition
+# call partition.accept() to keep it or partition.reject() to undo it
+def create_proposed_partition(partition, conflicted_edge):
+
+    # Get the nodes connected by the conflicted edge
+    node1, node2 = conflicted_edge
+
+    # Choose one of the nodes randomly and move it to the other node's district
+    node_to_move = rng.choice([node1, node2])
+    node_not_selected = node2 if node_to_move == node1 else node1
+
+    index = partition.index
+    district = int(partition.assignment[index[node_not_selected]])
+    partition.propose(index[node_to_move], district)
+
+    return partition
+
+
 # sum total population over entire graph
 def calculate_total_population(graph) -> int:
     total_population = sum(graph.nodes[node]['population'] for node in graph.nodes)
@@ -123,9 +205,12 @@ def calculate_total_population(graph) -> int:
 
 
 # population score function for calculating transition probabilities
-def populationscore(graph,subgraphs, c_pop = 0.3) -> float:
+# pass total_population to avoid re-summing the whole graph on every call
+# (see scoring.ScoreEngine for an incremental version of these scores)
+def populationscore(graph,subgraphs, c_pop = 0.3, total_population = None) -> float:
     totalsum=0
-    total_population=calculate_total_population(colorado_graph)
+    if total_population is None:
+        total_population=calculate_total_population(graph)
     districtaverage=total_population/len(subgraphs)
     for i, subgraph in enumerate(subgraphs, start=1):
         # Calculate the sum of populations for each subgraph
@@ -145,9 +230,9 @@ def PVIscore(graph, subgraphs, c_pvi=0.00003):
 
 
 # MCMC score function
-def totalscorefunction(graph,subgraph, lambda_J = 1) -> float:
-    pop_score = populationscore(graph, subgraph)
-    pvi_score = PVIscore(graph, subgraph)
+def totalscorefunction(graph,subgraph, lambda_J = 1, c_pop = 0.3, c_pvi = 0.00003) -> float:
+    pop_score = populationscore(graph, subgraph, c_pop)
+    pvi_score = PVIscore(graph, subgraph, c_pvi)
     score = (lambda_J * pop_score) + ((1 - lambda_J) * pvi_score)
     return score
 
@@ -176,7 +261,7 @@ def totalscorefunction(graph,subgraph, lambda_J = 1) -> float:
 #     # print(transitionprobability)
 
 #     # Generate a random number between 0 and 1
-#     random_number = np.random.rand()
+#     random_number = rng.random()
 
 #     # Check if the random number is less than the transition probability
 #     if random_number < transitionprobability:
@@ -0,0 +1,292 @@
+import random
+from partition import IndexedSet, flip_keeps_district_connected
+
+
+"""
+district_articulation_points function
+Inputs: partition: Partition
+        district:  district number
+Output: Set of nodes whose removal would disconnect the district
+
+Iterative version of Tarjan's algorithm that only walks the district's nodes.
+"""
+def district_articulation_points(partition, district) -> set:
+    assignment = partition.assignment
+    neighbors = partition.neighbors
+
+    discovered = {}
+    low = {}
+    points = set()
+    time = 0
+
+    for start in partition.members[district]:
+        if start in discovered:
+            continue
+
+        discovered[start] = low[start] = time
+        time += 1
+        root_children = 0
+        stack = [(start, -1, iter(neighbors[start]))]
+
+        while stack:
+            u, parent, remaining = stack[-1]
+
+            # walk to the next unvisited neighbor in the district, if any
+            advanced = False
+            for v in remaining:
+                if assignment[v] != district:
+                    continue
+                if v not in discovered:
+                    discovered[v] = low[v] = time
+                    time += 1
+                    stack.append((v, u, iter(neighbors[v])))
+                    advanced = True
+                    break
+                if v != parent:
+                    low[u] = min(low[u], discovered[v])
+            if advanced:
+                continue
+
+            # u is finished, so report back to its parent
+            stack.pop()
+            if not stack:
+                continue
+            p = stack[-1][0]
+            low[p] = min(low[p], low[u])
+            if p == start:
+                root_children += 1
+            elif low[u] >= discovered[p]:
+                points.add(p)
+
+        if root_children > 1:
+            points.add(start)
+
+    return points
+
+
+"""
+MoveGenerator class
+Keeps the set of every legal single-node flip of a Partition.
+
+A move is stored as (u, d), meaning "move u into district d", once for each
+district d that u borders, however many of u's neighbors are in d. A move is
+legal when u's district stays connected and non-empty without u, i.e. the
+district has more than one node and u is not one of its articulation points.
+
+Because only legal moves are stored, a valid proposal is drawn in one shot
+instead of retrying until one passes the contiguity check. Every distinct move
+is equally likely, so the number of legal moves before and after a flip gives
+the Metropolis-Hastings proposal ratio.
+
+After a flip from district a to district b, the articulation points of a and b
+are recomputed from scratch, which costs a search over both whole districts,
+so a step is O(size of the two districts). Only the moves whose legality could
+have changed are then refreshed: those of the moved node, its neighbors, and
+any node of a or b whose articulation status changed. For maps with many
+nodes per district use CutEdgeMoveGenerator, whose steps cost O(degree).
+"""
+class MoveGenerator:
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.articulation_points = [
+            district_articulation_points(partition, d)
+            for d in range(partition.num_districts)
+        ]
+        self.moves = IndexedSet()
+
+        # targets[u] lists the districts of u's stored moves
+        self.targets = [[] for _ in range(len(partition.nodes))]
+        for node in range(len(partition.nodes)):
+            self._add_moves(node)
+
+        # the flip waiting for accept() or reject(), as (node, old_district)
+        self.pending = None
+
+        # moves are drawn from the legal moves themselves, so never retried
+        self.retries = 0
+
+
+    # number of legal moves from the current plan
+    @property
+    def count(self) -> int:
+        return len(self.moves)
+
+
+    # can node leave its district without disconnecting or emptying it
+    def _can_leave(self, node) -> bool:
+        partition = self.partition
+        district = partition.assignment[node]
+        return (partition.district_size[district] > 1
+                and node not in self.articulation_points[district])
+
+
+    # add every legal move of node, one per district it borders
+    def _add_moves(self, node):
+        if not self._can_leave(node):
+            return
+        assignment = self.partition.assignment
+        district = assignment[node]
+        targets = self.targets[node]
+        for v in self.partition.neighbors[node]:
+            target = int(assignment[v])
+            if target != district and target not in targets:
+                targets.append(target)
+                self.moves.add((node, target))
+
+
+    # remove every move of node
+    def _remove_moves(self, node):
+        for target in self.targets[node]:
+            self.moves.discard((node, target))
+        self.targets[node] = []
+
+
+    # uniformly random legal move, as (node, district)
+    def random_move(self, rng = random) -> tuple:
+        if not self.moves:
+            return None
+        return self.moves.choice(rng)
+
+
+    # flip node into district and bring the legal moves up to date
+    def flip(self, node, district):
+        partition = self.partition
+        old = partition.flip(node, district)
+        if old == district:
+            return old
+
+        # articulation points can only change in the two districts involved,
+        # but finding them means searching both districts in full
+        changed = {node}
+        changed.update(partition.neighbors[node])
+        for d in (old, district):
+            points = district_articulation_points(partition, d)
+            changed.update(points.symmetric_difference(self.articulation_points[d]))
+            self.articulation_points[d] = points
+
+            # leaving a one-node district is never legal, so its size matters too
+            if partition.district_size[d] <= 2:
+                changed.update(partition.members[d])
+
+        # sorted, so the order of the moves only depends on the chain's history
+        # (this keeps a chain resumed from a checkpoint identical to the original)
+        for u in sorted(changed):
+            self._remove_moves(u)
+            self._add_moves(u)
+
+        return old
+
+
+    # apply a move as a pending proposal and return the proposal ratio
+    # (legal moves before / legal moves after) for the acceptance probability
+    def propose(self, node, district) -> float:
+        if self.pending is not None:
+            raise RuntimeError("a proposal is already pending")
+        count_before = self.count
+        old = self.flip(node, district)
+        self.pending = (node, old)
+        return count_before / self.count
+
+
+    # keep the pending move
+    def accept(self):
+        self.pending = None
+
+
+    # undo the pending move
+    def reject(self):
+        if self.pending is None:
+            return
+        node, old = self.pending
+        self.pending = None
+        self.flip(node, old)
+
+
+"""
+CutEdgeMoveGenerator class
+Same interface as MoveGenerator, for graphs too large to keep every district's
+articulation points up to date (recomputing them costs a search of two whole
+districts per step).
+
+A move is drawn as in mcmc_driver: a uniformly random cut edge, then one of its
+two endpoints, redrawn until the move keeps the endpoint's district connected.
+Contiguity is checked locally with flip_keeps_district_connected, and the only
+state kept is the Partition's cut-edge index, so a step costs O(degree) in the
+usual case regardless of the size of the map. The proposal ratio is the
+notebook's con1 / con2, the number of cut edges before and after the move.
+"""
+class CutEdgeMoveGenerator:
+
+    def __init__(self, partition):
+        self.partition = partition
+
+        # the flip waiting for accept() or reject(), as (node, old_district)
+        self.pending = None
+
+        # draws rejected for breaking contiguity before the last move was found
+        self.retries = 0
+
+
+    # number of cut edges of the current plan
+    @property
+    def count(self) -> int:
+        return self.partition.cut_edge_count
+
+
+    # random contiguity-preserving move, as (node, district), or None if the
+    # plan has no legal move
+    def random_move(self, rng = random) -> tuple:
+        partition = self.partition
+        cut_edges = partition.cut_edges
+        attempts = 0
+        while cut_edges:
+            u, v = cut_edges.choice(rng)
+            if rng.random() < 0.5:
+                u, v = v, u
+            if flip_keeps_district_connected(partition, u):
+                self.retries = attempts
+                return u, int(partition.assignment[v])
+
+            # after many failed draws, make sure there is something to find
+            attempts += 1
+            if attempts % (20 * len(cut_edges)) == 0 and not self._has_legal_move():
+                break
+        self.retries = attempts
+        return None
+
+
+    # does any endpoint of any cut edge have a legal move
+    def _has_legal_move(self) -> bool:
+        return any(flip_keeps_district_connected(self.partition, u)
+                   for edge in self.partition.cut_edges for u in edge)
+
+
+    # flip node into district
+    def flip(self, node, district):
+        return self.partition.flip(node, district)
+
+
+    # apply a move as a pending proposal and return the proposal ratio
+    # (cut edges before / cut edges after) for the acceptance probability
+    def propose(self, node, district) -> float:
+        if self.pending is not None:
+            raise RuntimeError("a proposal is already pending")
+        count_before = self.count
+        old = self.flip(node, district)
+        self.pending = (node, old)
+        return count_before / self.count
+
+
+    # keep the pending move
+    def accept(self):
+        self.pending = None
+
+
+    # undo the pending move
+    def reject(self):
+        if self.pending is None:
+            return
+        node, old = self.pending
+        self.pending = None
+        self.flip(node, old)
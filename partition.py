@@ -0,0 +1,369 @@
+import random
+from collections import deque
+import numpy as np
+from csr_graph import CSRGraph
+
+
+"""
+IndexedSet class
+A set that also supports drawing a uniformly random element in O(1).
+
+Items are kept in a list, with a dict mapping each item to its position.
+Removing an item swaps the last item into its place before popping.
+"""
+class IndexedSet:
+
+    def __init__(self, items = ()):
+        self.items = []
+        self.positions = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item):
+        if item in self.positions:
+            return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+
+    def discard(self, item):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self, rng = random):
+        return self.items[int(rng.random() * len(self.items))]
+
+    def copy(self):
+        new = IndexedSet()
+        new.items = list(self.items)
+        new.positions = dict(self.positions)
+        return new
+
+
+# population and PVI*population of every node, in graph.nodes order
+def node_attribute_arrays(graph) -> tuple:
+    if isinstance(graph, CSRGraph):
+        return graph.population, graph.pvi * graph.population
+
+    graph_nodes = graph.nodes
+    population = np.array(
+        [graph_nodes[u]["population"] for u in graph_nodes], dtype = np.int64
+    )
+    pvi = np.array(
+        [graph_nodes[u]["PVI"] for u in graph_nodes], dtype = np.int64
+    ) * population
+    return population, pvi
+
+
+"""
+Partition class
+A districting plan stored as arrays instead of networkx subgraphs.
+
+Nodes are referred to by their position in graph.nodes. For the graph returned
+by get_colorado_graph this is the same thing as the county ID. The graph can be
+a networkx graph or a csr_graph.CSRGraph, whose nodes already are positions.
+
+    assignment:          numpy array, assignment[node] = district of node
+    district_population: numpy array, total population of each district
+    district_pvi:        numpy array, sum of PVI*population of each district
+    district_size:       numpy array, number of nodes in each district
+    members:             list of sets, the nodes belonging to each district
+    cut_edges:           IndexedSet of edges (u, v), u < v, joining two districts
+
+Moving a node between districts is an in-place flip that only touches the
+moved node, so the graph is never copied.
+"""
+class Partition:
+
+    def __init__(self, graph, assignment, num_districts = None):
+
+        # the graph itself is shared and never modified
+        self.graph = graph
+        if isinstance(graph, CSRGraph):
+            # a range maps positions to themselves without a dict per node
+            self.nodes = graph.nodes
+            self.index = graph.nodes
+            self.neighbors = graph.neighbor_lists()
+        else:
+            self.nodes = list(graph.nodes)
+            self.index = {node: i for i, node in enumerate(self.nodes)}
+
+            # adjacency by node position, so inner loops avoid networkx lookups
+            self.neighbors = [
+                [self.index[v] for v in graph.adj[u]] for u in self.nodes
+            ]
+
+        # per-node attributes as contiguous arrays
+        self.population, self.pvi = node_attribute_arrays(graph)
+
+        self.assignment = np.array(assignment, dtype = np.int64)
+        if self.assignment.shape != (len(self.nodes),):
+            raise ValueError("assignment must have exactly one district per node")
+
+        if num_districts is None:
+            num_districts = int(self.assignment.max()) + 1
+        self.num_districts = num_districts
+        self._compute_aggregates()
+
+        # the flip waiting for accept() or reject(), as (node, old_district)
+        self.pending = None
+
+
+    # build a partition from a list of subgraphs (or lists of nodes)
+    @classmethod
+    def from_subgraphs(cls, graph, subgraphs):
+        if isinstance(graph, CSRGraph):
+            index = graph.nodes
+        else:
+            index = {node: i for i, node in enumerate(graph.nodes)}
+        assignment = np.full(len(index), -1, dtype = np.int64)
+        for district, subgraph in enumerate(subgraphs):
+            for node in subgraph:
+                assignment[index[node]] = district
+
+        if (assignment < 0).any():
+            raise ValueError("every node must belong to one of the subgraphs")
+
+        return cls(graph, assignment, num_districts = len(subgraphs))
+
+
+    # recompute every per-district aggregate from scratch
+    def _compute_aggregates(self):
+        k = self.num_districts
+        self.district_population = np.bincount(
+            self.assignment, weights = self.population, minlength = k
+        ).astype(np.int64)
+        self.district_pvi = np.bincount(
+            self.assignment, weights = self.pvi, minlength = k
+        ).astype(np.int64)
+        self.district_size = np.bincount(self.assignment, minlength = k)
+        order = np.argsort(self.assignment, kind = "stable")
+        bounds = np.cumsum(self.district_size)[:-1]
+        self.members = [set(m.tolist()) for m in np.split(order, bounds)]
+
+        # cut edges in the same order as looping over u, then its neighbors,
+        # but compared as whole arrays rather than one edge at a time
+        if isinstance(self.graph, CSRGraph):
+            rows = np.repeat(np.arange(len(self.nodes)), np.diff(self.graph.indptr))
+            cols = np.asarray(self.graph.indices)
+        else:
+            degree = [len(neighbors) for neighbors in self.neighbors]
+            rows = np.repeat(np.arange(len(self.nodes)), degree)
+            cols = np.array([v for neighbors in self.neighbors for v in neighbors],
+                            dtype = np.int64)
+        cut = (rows < cols) & (self.assignment[rows] != self.assignment[cols])
+        self.cut_edges = IndexedSet(zip(rows[cut].tolist(), cols[cut].tolist()))
+
+
+    # move a node into a new district in place, returning its old district
+    def flip(self, node, district):
+        old = int(self.assignment[node])
+        if old == district:
+            return old
+
+        pop = self.population[node]
+        pvi = self.pvi[node]
+
+        self.assignment[node] = district
+        self.district_population[old] -= pop
+        self.district_population[district] += pop
+        self.district_pvi[old] -= pvi
+        self.district_pvi[district] += pvi
+        self.district_size[old] -= 1
+        self.district_size[district] += 1
+        self.members[old].discard(node)
+        self.members[district].add(node)
+
+        # only edges touching the moved node can change between cut and uncut
+        assignment = self.assignment
+        cut_edges = self.cut_edges
+        for v in self.neighbors[node]:
+            edge = (node, v) if node < v else (v, node)
+            if assignment[v] == district:
+                cut_edges.discard(edge)
+            else:
+                cut_edges.add(edge)
+
+        return old
+
+
+    # number of edges joining two districts, used in the acceptance ratio
+    @property
+    def cut_edge_count(self) -> int:
+        return len(self.cut_edges)
+
+
+    # uniformly random edge joining two districts, as node positions
+    def random_cut_edge(self, rng = random) -> tuple:
+        if not self.cut_edges:
+            return None
+        return self.cut_edges.choice(rng)
+
+
+    # apply a flip that can later be kept with accept() or undone with reject()
+    def propose(self, node, district):
+        if self.pending is not None:
+            raise RuntimeError("a proposal is already pending")
+        old = self.flip(node, district)
+        self.pending = (node, old)
+        return old
+
+
+    # keep the pending flip
+    def accept(self):
+        self.pending = None
+
+
+    # undo the pending flip
+    def reject(self):
+        if self.pending is None:
+            return
+        node, old = self.pending
+        self.pending = None
+        self.flip(node, old)
+
+
+    # independent copy of the plan that shares the (read-only) graph data
+    def copy(self):
+        new = object.__new__(Partition)
+        new.__dict__.update(self.__dict__)
+        new.assignment = self.assignment.copy()
+        new.district_population = self.district_population.copy()
+        new.district_pvi = self.district_pvi.copy()
+        new.district_size = self.district_size.copy()
+        new.members = [set(m) for m in self.members]
+        new.cut_edges = self.cut_edges.copy()
+        new.pending = None
+        return new
+
+
+    # list of the nodes (graph labels) in each district
+    def district_nodes(self):
+        return [[self.nodes[i] for i in sorted(m)] for m in self.members]
+
+
+    # convert back to the subgraph representation used by mcmc_driver
+    def to_subgraphs(self) -> list:
+        return [self.graph.subgraph(nodes) for nodes in self.district_nodes()]
+
+
+"""
+flip_keeps_district_connected function
+Inputs: partition: Partition whose districts are currently connected
+        node:      position of the node that would leave its district
+Output: True if the node's district stays connected (and non-empty) without it
+
+Only the node's own district can become disconnected, and it does exactly when
+the node's same-district neighbors stop being connected to one another. A
+search is started from each of those neighbors and the searches are grown in
+turn, merging whenever they meet:
+    - all searches merged:       the district stays connected
+    - one search runs out first: that piece is cut off
+This usually finishes within a few hops of the moved node. In the worst case it
+visits the whole district, which is the same work as a full connectivity check.
+"""
+def flip_keeps_district_connected(partition, node) -> bool:
+    assignment = partition.assignment
+    neighbors = partition.neighbors
+    district = assignment[node]
+
+    targets = [v for v in neighbors[node] if assignment[v] == district]
+
+    # the node is the whole district, so moving it would leave it empty
+    if not targets:
+        return False
+
+    # the node is a leaf of its district
+    if len(targets) == 1:
+        return True
+
+    # owner[v] = search that reached v first; the moved node counts as removed
+    owner = {node: -1}
+    root = list(range(len(targets)))
+    frontiers = {}
+    for i, target in enumerate(targets):
+        owner[target] = i
+        frontiers[i] = deque([target])
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    remaining = len(targets)
+    while True:
+        for i in list(frontiers):
+
+            # this search was merged into another one earlier in the round
+            if i not in frontiers:
+                continue
+
+            queue = frontiers[i]
+            if not queue:
+                return False
+
+            u = queue.popleft()
+            for v in neighbors[u]:
+                if assignment[v] != district:
+                    continue
+
+                j = owner.get(v)
+                if j is None:
+                    owner[v] = i
+                    queue.append(v)
+                elif j != -1:
+                    j = find(j)
+                    if j != i:
+
+                        # two searches met, so keep exploring them as one
+                        root[j] = i
+                        queue.extend(frontiers.pop(j))
+                        remaining -= 1
+                        if remaining == 1:
+                            return True
+
+
+# full check that a district is connected, by searching all of it
+def is_district_connected(partition, district) -> bool:
+    members = partition.members[district]
+    if not members:
+        return False
+
+    assignment = partition.assignment
+    neighbors = partition.neighbors
+    start = next(iter(members))
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        u = queue.popleft()
+        for v in neighbors[u]:
+            if v not in seen and assignment[v] == district:
+                seen.add(v)
+                queue.append(v)
+
+    return len(seen) == len(members)
+
+
+# raise a ValueError if any district of the plan is empty or disconnected
+def check_contiguous(partition):
+    for district in range(partition.num_districts):
+        if not is_district_connected(partition, district):
+            raise ValueError(f"""
+            The plan is not contiguous: district {district} is empty or
+            disconnected. Chains must start from a plan whose districts are
+            all connected.
+            """)
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+
+"""
+Chain profiling
+A ChainProfiler times each stage of MarkovChain.step and hands one record per
+step to its sinks. The stages are:
+
+    proposal     drawing a move, including draws redrawn for breaking
+                 contiguity (the notebook's get_a_valid_conflicted_edge_colorado)
+    scoring      score change of the move (ScoreEngine)
+    apply        applying the move and updating the cut edges and legal moves
+                 (the notebook's create_proposed_state), which also gives the
+                 proposal ratio
+    acceptance   the accept / reject decision, including undoing a rejected move
+
+A chain without a profiler (the default) runs its usual step, so profiling
+costs nothing unless it is switched on.
+"""
+
+STAGES = ("proposal", "scoring", "apply", "acceptance")
+
+logger = logging.getLogger(__name__)
+
+
+"""
+ProfileSummary class
+Running totals over many step records: steps, accepted steps, retries, seconds
+spent in each stage and bytes allocated. as_dict() gives the totals with
+per-step averages and the acceptance rate.
+"""
+class ProfileSummary:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.accepted = 0
+        self.retries = 0
+        self.accepted_retries = 0
+        self.max_retries = 0
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.allocated_bytes = 0
+
+    def add(self, record):
+        self.steps += 1
+        self.retries += record["retries"]
+        self.max_retries = max(self.max_retries, record["retries"])
+        if record["accepted"]:
+            self.accepted += 1
+            self.accepted_retries += record["retries"]
+        for stage in STAGES:
+            self.seconds[stage] += record[stage]
+        self.allocated_bytes += record.get("allocated_bytes", 0)
+
+    def as_dict(self) -> dict:
+        steps = max(self.steps, 1)
+        total = sum(self.seconds.values())
+        return dict(
+            steps = self.steps,
+            acceptance_rate = self.accepted / steps,
+            retries_per_step = self.retries / steps,
+            retries_per_accepted = self.accepted_retries / max(self.accepted, 1),
+            max_retries = self.max_retries,
+            seconds = dict(self.seconds),
+            seconds_per_step = total / steps,
+            stage_share = {stage: (seconds / total if total else 0.0)
+                           for stage, seconds in self.seconds.items()},
+            allocated_bytes_per_step = self.allocated_bytes / steps
+        )
+
+
+"""
+SummarySink class
+Keeps a ProfileSummary of every step in memory; read it with summary().
+"""
+class SummarySink:
+
+    def __init__(self):
+        self.totals = ProfileSummary()
+
+    def record(self, record):
+        self.totals.add(record)
+
+    def summary(self) -> dict:
+        return self.totals.as_dict()
+
+    def close(self):
+        pass
+
+
+"""
+LogSink class
+Logs a summary of the last `every` steps through the logging module (to the
+"profiling" logger unless another one is given).
+"""
+class LogSink:
+
+    def __init__(self, every = 10000, log = None, level = logging.INFO):
+        self.every = every
+        self.log = log if log is not None else logger
+        self.level = level
+        self.window = ProfileSummary()
+        self.step = 0
+
+    def record(self, record):
+        self.window.add(record)
+        self.step = record["step"]
+        if self.window.steps >= self.every:
+            self.emit()
+
+    # log the current window, if it has any steps, and start a new one
+    def emit(self):
+        if self.window.steps == 0:
+            return
+        summary = self.window.as_dict()
+        stages = " ".join(f"{stage}={share:.0%}"
+                          for stage, share in summary["stage_share"].items())
+        self.log.log(
+            self.level,
+            "step %d: %.1f us/step, acceptance %.3f, %.2f retries/accepted, "
+            "%.0f bytes/step, %s",
+            self.step, summary["seconds_per_step"] * 1e6, summary["acceptance_rate"],
+            summary["retries_per_accepted"], summary["allocated_bytes_per_step"], stages
+        )
+        self.window.reset()
+
+    def close(self):
+        self.emit()
+
+
+"""
+JsonLinesSink class
+Appends records to a JSON lines file. With every = 1 each step is written as
+is; otherwise one summary (ProfileSummary.as_dict plus the last step number)
+is written per `every` steps. The file is opened on the first record, so a
+chain holding this sink can still be sent to a worker process.
+"""
+class JsonLinesSink:
+
+    def __init__(self, path, every = 1):
+        self.path = path
+        self.every = every
+        self.window = ProfileSummary()
+        self.step = 0
+        self.file = None
+
+    def write(self, data):
+        if self.file is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok = True)
+            self.file = open(self.path, "a")
+        self.file.write(json.dumps(data) + "\n")
+
+    def record(self, record):
+        if self.every == 1:
+            self.write(record)
+            return
+        self.window.add(record)
+        self.step = record["step"]
+        if self.window.steps >= self.every:
+            self.emit()
+
+    # write the current window, if it has any steps, and start a new one
+    def emit(self):
+        if self.window.steps == 0:
+            return
+        self.write(dict(step = self.step, **self.window.as_dict()))
+        self.window.reset()
+
+    def close(self):
+        self.emit()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["file"] = None
+        return state
+
+
+"""
+ChainProfiler class
+Inputs: sinks:             objects with record(record) and close(), e.g.
+                           SummarySink, LogSink or JsonLinesSink (default: one
+                           SummarySink)
+        track_allocations: also record the bytes allocated during each step
+                           (with tracemalloc, which slows the chain down a lot)
+
+Pass it to MarkovChain (profiler = ...) and every step produces a record:
+
+    step:             the chain's step count after the step
+    accepted:         whether the move was accepted
+    retries:          draws redrawn before the move was found (0 for
+                      MoveGenerator, which only draws legal moves)
+    proposal, scoring, apply, acceptance: seconds spent in each stage
+    allocated_bytes:  peak memory allocated during the step (only with
+                      track_allocations)
+"""
+class ChainProfiler:
+
+    def __init__(self, sinks = None, track_allocations = False):
+        self.sinks = list(sinks) if sinks is not None else [SummarySink()]
+        self.track_allocations = track_allocations
+        self.clock = time.perf_counter
+
+    # called at the start of a step
+    def start(self):
+        if self.track_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.traced_before = tracemalloc.get_traced_memory()[0]
+
+    # called at the end of a step with the chain's record of it
+    def record(self, record):
+        if self.track_allocations:
+            record["allocated_bytes"] = max(
+                tracemalloc.get_traced_memory()[1] - self.traced_before, 0
+            )
+        for sink in self.sinks:
+            sink.record(record)
+
+    # in-memory summary of the first SummarySink, or None without one
+    def summary(self) -> dict:
+        for sink in self.sinks:
+            if isinstance(sink, SummarySink):
+                return sink.summary()
+        return None
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
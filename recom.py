@@ -0,0 +1,217 @@
+import random
+import numpy as np
+from partition import check_contiguous
+
+
+"""
+random_spanning_tree function
+Inputs: adjacency: dict mapping each node of a connected region to its
+                   neighbors inside the region
+        rng:       random number generator (only rng.random() is used)
+Output: (root, parent) where parent maps every other node to its parent
+
+Wilson's algorithm: loop-erased random walks from each node until they hit
+the tree built so far. The result is a uniformly random spanning tree.
+"""
+def random_spanning_tree(adjacency, rng = random) -> tuple:
+    nodes = list(adjacency)
+    root = nodes[int(rng.random() * len(nodes))]
+    in_tree = {root}
+    parent = {}
+    step = {}
+
+    for start in nodes:
+
+        # random walk until the tree is hit, remembering only the last exit
+        # from each node (which erases the loops)
+        u = start
+        while u not in in_tree:
+            neighbors = adjacency[u]
+            step[u] = neighbors[int(rng.random() * len(neighbors))]
+            u = step[u]
+
+        # add the loop-erased path to the tree
+        u = start
+        while u not in in_tree:
+            in_tree.add(u)
+            parent[u] = step[u]
+            u = step[u]
+
+    return root, parent
+
+
+"""
+balanced_cut function
+Inputs: root, parent: spanning tree from random_spanning_tree
+        population:   per-node population array
+        epsilon:      allowed relative deviation of each piece from half of
+                      the region's population
+        rng:          random number generator
+Output: list of the nodes below a randomly chosen balanced tree edge, or None
+        if no edge of this tree splits the region into balanced pieces
+
+Cutting the edge between a node and its parent splits the tree into the
+node's subtree and everything else, so the candidate edges are the nodes
+whose subtree population is within epsilon of half the total.
+"""
+def balanced_cut(root, parent, population, epsilon, rng = random) -> list:
+    children = {root: []}
+    for u in parent:
+        children[u] = []
+    for u, p in parent.items():
+        children[p].append(u)
+
+    # breadth-first order, so every node comes after its parent
+    order = [root]
+    for u in order:
+        order.extend(children[u])
+
+    subtree = {}
+    for u in reversed(order):
+        subtree[u] = int(population[u]) + sum(subtree[c] for c in children[u])
+
+    total = subtree[root]
+    low = total / 2 * (1 - epsilon)
+    high = total / 2 * (1 + epsilon)
+    candidates = [u for u in order[1:]
+                  if low <= subtree[u] <= high and low <= total - subtree[u] <= high]
+    if not candidates:
+        return None
+
+    cut = candidates[int(rng.random() * len(candidates))]
+    piece = [cut]
+    for u in piece:
+        piece.extend(children[u])
+    return piece
+
+
+"""
+ReCom class
+Spanning-tree recombination proposal, with the same interface as
+moves.MoveGenerator, so it plugs into MarkovChain:
+
+    1. pick a uniformly random cut edge; its two districts are merged
+    2. draw a uniformly random spanning tree of the merged region
+    3. cut a random tree edge that leaves two pieces whose populations are
+       within epsilon of half the region's population
+    4. the pieces become the two new districts
+
+If a tree has no balanced edge, steps 1 to 3 are repeated with a new pair of
+districts, up to max_attempts times.
+
+Every district of the starting plan must be contiguous, since a merged region
+is only guaranteed to have a spanning tree if both of its districts are
+connected. Both new districts are connected by construction. A move relabels many nodes
+at once, so random_move returns arrays of nodes and districts, and each
+piece keeps the label of the old district it overlaps most, which keeps the
+number of relabeled nodes small.
+
+The proposal ratio is taken to be 1, as in GerryChain's ReCom, so a step is
+accepted with probability min(1, exp(-beta * delta)). Each step costs a walk
+over two whole districts, but plans decorrelate in far fewer steps than with
+single-node flips.
+
+Use functools.partial(ReCom, epsilon = ...) to pass other settings to
+MarkovChain or run_chain.
+"""
+class ReCom:
+
+    def __init__(self, partition, epsilon = 0.1, max_attempts = 1000):
+        check_contiguous(partition)
+        self.partition = partition
+        self.epsilon = epsilon
+        self.max_attempts = max_attempts
+
+        # the move waiting for accept() or reject(), as (nodes, old_districts)
+        self.pending = None
+
+        # spanning trees without a balanced cut drawn before the last move
+        self.retries = 0
+
+
+    # number of cut edges, i.e. the ways of choosing the pair to merge
+    @property
+    def count(self) -> int:
+        return self.partition.cut_edge_count
+
+
+    # adjacency of the region formed by two districts
+    def _region(self, a, b) -> dict:
+        partition = self.partition
+        assignment = partition.assignment
+        neighbors = partition.neighbors
+
+        # sorted, so a move only depends on the chain's random draws
+        nodes = sorted(partition.members[a] | partition.members[b])
+        return {
+            u: [v for v in neighbors[u] if assignment[v] == a or assignment[v] == b]
+            for u in nodes
+        }
+
+
+    # random recombination of two adjacent districts, as (nodes, districts):
+    # arrays of the nodes that change district and the district each one joins
+    def random_move(self, rng = random) -> tuple:
+        partition = self.partition
+        assignment = partition.assignment
+
+        for attempt in range(self.max_attempts):
+            self.retries = attempt
+            edge = partition.random_cut_edge(rng)
+            if edge is None:
+                break
+            a = int(assignment[edge[0]])
+            b = int(assignment[edge[1]])
+
+            root, parent = random_spanning_tree(self._region(a, b), rng)
+            piece = balanced_cut(root, parent, partition.population, self.epsilon, rng)
+            if piece is None:
+                continue
+
+            # the piece keeps whichever label it shares more nodes with
+            piece = np.array(sorted(piece), dtype = np.int64)
+            in_a = int((assignment[piece] == a).sum())
+            inside, outside = (a, b) if 2 * in_a >= len(piece) else (b, a)
+
+            region = np.array(sorted(partition.members[a] | partition.members[b]),
+                              dtype = np.int64)
+            districts = np.full(len(region), outside, dtype = np.int64)
+            districts[np.isin(region, piece)] = inside
+            changed = assignment[region] != districts
+            return region[changed], districts[changed]
+
+        raise RuntimeError(f"""
+        No balanced recombination was found in {self.max_attempts} attempts.
+        Try a larger epsilon.
+        """)
+
+
+    # move every node into its new district
+    def flip(self, nodes, districts):
+        partition = self.partition
+        for node, district in zip(nodes.tolist(), districts.tolist()):
+            partition.flip(node, district)
+
+
+    # apply a move as a pending proposal and return the proposal ratio
+    def propose(self, nodes, districts) -> float:
+        if self.pending is not None:
+            raise RuntimeError("a proposal is already pending")
+        old = self.partition.assignment[nodes]
+        self.flip(nodes, districts)
+        self.pending = (nodes, old)
+        return 1.0
+
+
+    # keep the pending move
+    def accept(self):
+        self.pending = None
+
+
+    # undo the pending move
+    def reject(self):
+        if self.pending is None:
+            return
+        nodes, old = self.pending
+        self.pending = None
+        self.flip(nodes, old)
@@ -0,0 +1,213 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import networkx as nx
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+from matplotlib.animation import FFMpegWriter
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from fliplog import FlipLogReader
+
+
+# 8x8 grid of county IDs that roughly matches Colorado's shape
+COLORADO_LAYOUT = {
+    41: (0, 7), 54: (1, 7), 29: (2, 7), 35: (3, 7), 62: (4, 7), 38: (5, 7), 48: (6, 7), 58: (7, 7),
+    52: (0, 6), 59: (1, 6), 19: (2, 6), 25: (3, 6), 6:  (4, 6), 7:  (5, 6), 0:  (6, 6), 44: (7, 6),
+    23: (0, 5), 10: (1, 5), 24: (2, 5), 30: (3, 5), 16: (4, 5), 2:  (5, 5), 61: (6, 5), 63: (7, 5),
+    39: (0, 4), 8:  (1, 4), 34: (2, 4), 47: (3, 4), 60: (4, 4), 18: (5, 4), 21: (6, 4), 37: (7, 4),
+    49: (0, 3), 22: (1, 3), 20: (2, 3), 14: (3, 3), 13: (4, 3), 31: (5, 3), 9:  (6, 3), 32: (7, 3),
+    43: (0, 2), 15: (1, 2), 26: (2, 2), 55: (3, 2), 51: (4, 2), 5:  (5, 2), 50: (6, 2), 4:  (7, 2),
+    57: (0, 1), 46: (1, 1), 27: (2, 1), 40: (3, 1), 17: (4, 1), 28: (5, 1), 53: (6, 1), 1:  (7, 1),
+    3:  (0, 0), 11: (1, 0), 12: (2, 0), 36: (3, 0), 45: (4, 0), 56: (5, 0), 42: (6, 0), 33: (7, 0)
+}
+
+
+"""
+FrameRenderer class
+Draws plans in the style of the notebook's visualize_subgraphs3, but the
+static parts (nodes, edges, labels and the layout) are drawn only once. Each
+frame just recolors the existing node and edge artists:
+
+    - a node gets the color of its district (C1, C2, ... as in the notebook)
+    - an edge gets its district's color if both ends are in the same district,
+      and stays gray if it is a cut edge
+
+Uses a bare Agg canvas rather than pyplot, so it is safe in worker processes.
+"""
+class FrameRenderer:
+
+    def __init__(self, graph, num_districts, layout = None, node_size = 700,
+                 figsize = (8, 8), dpi = 100):
+        if layout is None:
+            layout = COLORADO_LAYOUT
+
+        self.figure = Figure(figsize = figsize, dpi = dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+        ax.set_axis_off()
+
+        # the static base, drawn once
+        nodes = list(graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = list(graph.edges)
+        self.edge_ends = np.array([(index[u], index[v]) for u, v in edges],
+                                  dtype = np.int64).reshape(-1, 2)
+        self.edge_artist = nx.draw_networkx_edges(
+            graph, pos = layout, edgelist = edges, edge_color = "gray", ax = ax
+        )
+        self.node_artist = nx.draw_networkx_nodes(
+            graph, pos = layout, nodelist = nodes, node_color = "lightgray",
+            node_size = node_size, ax = ax
+        )
+        nx.draw_networkx_labels(graph, pos = layout, font_weight = "bold", ax = ax)
+        self.score_text = ax.text(0.8, -0.05, "", transform = ax.transAxes,
+                                  fontsize = 10, color = "black")
+
+        self.palette = to_rgba_array([f"C{d + 1}" for d in range(num_districts)])
+        self.gray = to_rgba_array("gray")[0]
+
+
+    # recolor the artists for a plan (assignment in graph.nodes order)
+    def draw(self, assignment, score = None):
+        assignment = np.asarray(assignment)
+        self.node_artist.set_facecolor(self.palette[assignment])
+
+        ends = assignment[self.edge_ends]
+        edge_colors = self.palette[ends[:, 0]]
+        edge_colors[ends[:, 0] != ends[:, 1]] = self.gray
+        self.edge_artist.set_color(edge_colors)
+
+        self.score_text.set_text("" if score is None else f"Score: {score:.6g}")
+
+
+    # save the current frame to an image file
+    def save(self, path):
+        self.figure.savefig(path, format = os.path.splitext(path)[1][1:] or "png")
+
+
+# yield (step, plan, score) for each of the given increasing steps of a flip log
+# the first plan is rebuilt from a keyframe, then the log is walked flip by flip
+def iterate_plans(reader, steps):
+    steps = list(steps)
+    if not steps:
+        return
+    plan = reader.assignment(steps[0])
+    previous = steps[0]
+    for step in steps:
+        flips = reader.flips[previous:step]
+        flips = flips[flips["accepted"]]
+        for node, district in zip(flips["node"].tolist(), flips["to_district"].tolist()):
+            plan[node] = district
+        previous = step
+
+        score = float(reader.flips["score"][step - 1]) if step > 0 else None
+        yield step, plan, score
+
+
+# render a block of frames from a flip log; runs in a worker process
+def _render_block(graph, num_districts, layout, flip_log_path, output_dir,
+                  steps, frame_numbers, renderer_args):
+    reader = FlipLogReader(flip_log_path)
+    renderer = FrameRenderer(graph, num_districts, layout, **renderer_args)
+
+    for (step, plan, score), frame in zip(iterate_plans(reader, steps), frame_numbers):
+        renderer.draw(plan, score)
+        renderer.save(os.path.join(output_dir, f"frame_{frame}.png"))
+
+    return len(steps)
+
+
+"""
+render_frames function
+Renders the plans recorded in a flip log to PNG files, in parallel.
+
+Inputs: graph:          graph the chain ran on
+        num_districts:  number of districts
+        flip_log_path:  flip log written by fliplog.FlipLogWriter
+        output_dir:     directory for frame_<i>.png files
+        layout:         node positions (default: COLORADO_LAYOUT)
+        stride:         render the plan after every stride-th step
+        start, stop:    range of steps to render (default: the whole log)
+        workers:        number of worker processes (default: every core)
+        background:     if True, return a Future right away instead of waiting
+        remaining keyword arguments are passed on to FrameRenderer
+Output: Number of frames rendered (or a Future of it, with background = True)
+
+Frames are split into contiguous blocks, one per worker, and each worker
+draws the static base once. Since the frames come from the flip log rather
+than from the chain itself, sampling never waits on Matplotlib: the chain can
+keep running while an earlier part of its log is rendered.
+"""
+def render_frames(graph, num_districts, flip_log_path, output_dir = "frames",
+                  layout = None, stride = 1, start = 0, stop = None, workers = None,
+                  background = False, **renderer_args):
+    if background:
+        executor = ThreadPoolExecutor(max_workers = 1)
+        future = executor.submit(render_frames, graph, num_districts, flip_log_path,
+                                 output_dir, layout, stride, start, stop, workers,
+                                 False, **renderer_args)
+        executor.shutdown(wait = False)
+        return future
+
+    os.makedirs(output_dir, exist_ok = True)
+    if stop is None:
+        stop = len(FlipLogReader(flip_log_path))
+    steps = list(range(start, stop + 1, stride))
+    if not steps:
+        return 0
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(steps)))
+    blocks = np.array_split(np.arange(len(steps)), workers)
+    tasks = [
+        (graph, num_districts, layout, flip_log_path, output_dir,
+         [steps[i] for i in block], block.tolist(), renderer_args)
+        for block in blocks if len(block)
+    ]
+
+    if workers == 1:
+        return sum(_render_block(*task) for task in tasks)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return sum(pool.map(_render_block, *zip(*tasks)))
+
+
+"""
+write_video function
+Encodes the plans recorded in a flip log straight into a video file, without
+writing any intermediate images. Each frame is drawn with FrameRenderer and
+its raw pixels are piped into ffmpeg through Matplotlib's FFMpegWriter.
+
+Inputs: graph:          graph the chain ran on
+        num_districts:  number of districts
+        flip_log_path:  flip log written by fliplog.FlipLogWriter
+        output_path:    video file to write, e.g. "colorado_lambda1_video.mp4"
+        stride:         one frame for every stride-th step
+        fps:            frames per second of the video
+        start, stop:    range of steps to include (default: the whole log)
+        layout:         node positions (default: COLORADO_LAYOUT)
+        writer:         a Matplotlib MovieWriter to use instead of FFMpegWriter
+        remaining keyword arguments are passed on to FrameRenderer
+Output: Number of frames written
+"""
+def write_video(graph, num_districts, flip_log_path, output_path, stride = 1,
+                fps = 10, start = 0, stop = None, layout = None, writer = None,
+                **renderer_args) -> int:
+    if writer is None:
+        if not FFMpegWriter.isAvailable():
+            raise RuntimeError("ffmpeg was not found, so the video cannot be encoded")
+        writer = FFMpegWriter(fps = fps)
+
+    reader = FlipLogReader(flip_log_path)
+    renderer = FrameRenderer(graph, num_districts, layout, **renderer_args)
+    if stop is None:
+        stop = len(reader)
+
+    frames = 0
+    with writer.saving(renderer.figure, output_path, renderer.figure.dpi):
+        for _, plan, score in iterate_plans(reader, range(start, stop + 1, stride)):
+            renderer.draw(plan, score)
+            writer.grab_frame()
+            frames += 1
+
+    return frames
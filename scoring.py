@@ -0,0 +1,232 @@
+import numpy as np
+from partition import node_attribute_arrays
+
+
+"""
+ScoreEngine class
+Incremental version of totalscorefunction from mcmc_driver.py for a Partition.
+
+The population and PVI scores only depend on the per-district totals kept by
+the Partition, so the change in score caused by moving a single node can be
+found in constant time instead of re-summing every node of every district.
+
+    population score = c_pop * sum over districts of (population - average)^2
+    PVI score        = c_pvi * sum over districts of |sum of PVI*population|
+    total score      = lambda_J * population score + (1 - lambda_J) * PVI score
+
+With verify = True, every delta is cross-checked against a full recomputation
+over all nodes. This is slow and only meant for debugging.
+"""
+class ScoreEngine:
+
+    def __init__(self, partition, lambda_J = 1, c_pop = 0.3, c_pvi = 0.00003,
+                 verify = False):
+        self.partition = partition
+        self.lambda_J = lambda_J
+        self.c_pop = c_pop
+        self.c_pvi = c_pvi
+        self.verify = verify
+
+        # the ideal district population never changes during a chain
+        total_population = int(partition.population.sum())
+        self.district_average = total_population / partition.num_districts
+
+
+    # population score of the partition's current plan
+    def population_score(self) -> float:
+        deviation = self.partition.district_population - self.district_average
+        return self.c_pop * float(np.dot(deviation, deviation))
+
+
+    # PVI score of the partition's current plan
+    def pvi_score(self) -> float:
+        return self.c_pvi * float(np.abs(self.partition.district_pvi).sum())
+
+
+    # total score of the partition's current plan, O(number of districts)
+    def score(self) -> float:
+        return (self.lambda_J * self.population_score()
+                + (1 - self.lambda_J) * self.pvi_score())
+
+
+    # change in total score if node moved into district, O(1)
+    def flip_delta(self, node, district) -> float:
+        partition = self.partition
+        old = int(partition.assignment[node])
+        if old == district:
+            return 0.0
+
+        pop = int(partition.population[node])
+        pvi = int(partition.pvi[node])
+        avg = self.district_average
+
+        # population term only changes for the two districts involved
+        pop_old = float(partition.district_population[old]) - avg
+        pop_new = float(partition.district_population[district]) - avg
+        pop_delta = ((pop_old - pop) ** 2 - pop_old ** 2
+                     + (pop_new + pop) ** 2 - pop_new ** 2)
+
+        # same for the PVI term
+        pvi_old = int(partition.district_pvi[old])
+        pvi_new = int(partition.district_pvi[district])
+        pvi_delta = (abs(pvi_old - pvi) - abs(pvi_old)
+                     + abs(pvi_new + pvi) - abs(pvi_new))
+
+        delta = (self.lambda_J * self.c_pop * pop_delta
+                 + (1 - self.lambda_J) * self.c_pvi * pvi_delta)
+
+        if self.verify:
+            self._check_delta(node, district, delta)
+
+        return delta
+
+
+    # change in total score if every node in nodes moved into the matching
+    # entry of districts (e.g. a recombination), O(len(nodes) + districts)
+    def move_delta(self, nodes, districts) -> float:
+        partition = self.partition
+        population = partition.population[nodes]
+        pvi = partition.pvi[nodes]
+        old = partition.assignment[nodes]
+
+        district_population = partition.district_population.copy()
+        np.subtract.at(district_population, old, population)
+        np.add.at(district_population, districts, population)
+        district_pvi = partition.district_pvi.copy()
+        np.subtract.at(district_pvi, old, pvi)
+        np.add.at(district_pvi, districts, pvi)
+
+        deviation = district_population - self.district_average
+        pop_score = self.c_pop * float(np.dot(deviation, deviation))
+        pvi_score = self.c_pvi * float(np.abs(district_pvi).sum())
+        delta = (self.lambda_J * pop_score + (1 - self.lambda_J) * pvi_score
+                 - self.score())
+
+        if self.verify:
+            proposed = partition.assignment.copy()
+            proposed[nodes] = districts
+            expected = self.full_score(proposed) - self.full_score()
+            if abs(expected - delta) > 1e-9 * max(1.0, abs(self.score())):
+                raise RuntimeError(f"""
+                Incremental score delta {delta} for moving {len(nodes)} nodes
+                does not match the full recomputation {expected}.
+                """)
+
+        return delta
+
+
+    # total score of an assignment, recomputed from every node, O(n)
+    def full_score(self, assignment = None) -> float:
+        partition = self.partition
+        if assignment is None:
+            assignment = partition.assignment
+
+        k = partition.num_districts
+        district_population = np.zeros(k)
+        district_pvi = np.zeros(k)
+        for node, district in enumerate(assignment):
+            district_population[district] += partition.population[node]
+            district_pvi[district] += partition.pvi[node]
+
+        deviation = district_population - self.district_average
+        pop_score = self.c_pop * float(np.dot(deviation, deviation))
+        pvi_score = self.c_pvi * float(np.abs(district_pvi).sum())
+        return self.lambda_J * pop_score + (1 - self.lambda_J) * pvi_score
+
+
+    # compare an incremental delta with the full recomputation
+    def _check_delta(self, node, district, delta):
+        proposed = self.partition.assignment.copy()
+        proposed[node] = district
+        current_score = self.full_score()
+        expected = self.full_score(proposed) - current_score
+
+        # allow for floating point error relative to the size of the scores
+        tolerance = 1e-9 * max(1.0, abs(current_score))
+        if abs(expected - delta) > tolerance:
+            error = f"""
+            Incremental score delta {delta} for moving node {node} to district
+            {district} does not match the full recomputation {expected}.
+            """
+            raise RuntimeError(error)
+
+
+"""
+district_totals function
+Inputs: assignments: (plans, nodes) array, assignments[p, node] = district
+        weights:     (nodes,) array of a per-node value, e.g. population
+        k:           number of districts
+Output: (plans, k) array with the total of weights in each district of each plan
+
+Each plan's districts are offset by k * plan so a single bincount sums every
+district of every plan at once.
+"""
+def district_totals(assignments, weights, k):
+    assignments = np.asarray(assignments, dtype = np.int64)
+    plans, nodes = assignments.shape
+    offsets = (np.arange(plans, dtype = np.int64) * k)[:, None]
+    totals = np.bincount(
+        (assignments + offsets).ravel(),
+        weights = np.broadcast_to(weights, (plans, nodes)).ravel(),
+        minlength = plans * k
+    )
+    return totals.reshape(plans, k)
+
+
+"""
+batch_scores function
+Inputs: graph:         networkx graph the plans were drawn on
+        assignments:   (plans, nodes) array of plans, nodes in graph.nodes order;
+                       anything that can be sliced by rows works, e.g. a
+                       memory-mapped array or TrajectoryReader.assignments
+        lambda_J, c_pop, c_pvi: same weights as totalscorefunction
+        num_districts: number of districts (default: largest district + 1)
+        chunk_size:    number of plans read and aggregated at a time, to bound
+                       memory
+Output: Dictionary of (plans,) arrays: population_score, pvi_score, total_score
+
+Rescores a whole ensemble with NumPy aggregation instead of calling
+totalscorefunction on each plan. The unweighted sums are also returned as
+population_sum and pvi_sum, so rescoring under other weights is just
+    lambda_J * c_pop * population_sum + (1 - lambda_J) * c_pvi * pvi_sum
+"""
+def batch_scores(graph, assignments, lambda_J = 1, c_pop = 0.3, c_pvi = 0.00003,
+                 num_districts = None, chunk_size = 100000) -> dict:
+    # a single plan
+    if len(assignments) and np.ndim(assignments[0]) == 0:
+        assignments = np.asarray(assignments, dtype = np.int64)[None, :]
+
+    population, pvi = node_attribute_arrays(graph)
+    plans = len(assignments)
+
+    # only one chunk of plans is ever converted to int64 at a time
+    def read_chunk(start) -> np.ndarray:
+        chunk = np.asarray(assignments[start:start + chunk_size], dtype = np.int64)
+        if chunk.ndim != 2 or chunk.shape[1] != len(population):
+            raise ValueError("assignments must have one column per node of the graph")
+        return chunk
+
+    k = num_districts
+    if k is None:
+        k = max((int(read_chunk(start).max()) for start in range(0, plans, chunk_size)),
+                default = 0) + 1
+    district_average = population.sum() / k
+
+    population_sum = np.empty(plans)
+    pvi_sum = np.empty(plans)
+    for start in range(0, plans, chunk_size):
+        chunk = read_chunk(start)
+        deviation = district_totals(chunk, population, k) - district_average
+        population_sum[start:start + len(chunk)] = np.einsum("ij,ij->i", deviation, deviation)
+        pvi_sum[start:start + len(chunk)] = np.abs(district_totals(chunk, pvi, k)).sum(axis = 1)
+
+    population_score = c_pop * population_sum
+    pvi_score = c_pvi * pvi_sum
+
+    return dict(
+        population_score = population_score,
+        pvi_score = pvi_score,
+        total_score = lambda_J * population_score + (1 - lambda_J) * pvi_score,
+        population_sum = population_sum,
+        pvi_sum = pvi_sum
+    )
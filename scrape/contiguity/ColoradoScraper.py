@@ -1,5 +1,9 @@
 # run on python 3.11.2
+import json
+import os
 import re
+import sys
+import numpy as np
 from csv import writer
 
 """
@@ -161,8 +165,126 @@ def find_colorado_counties(input_path: str, output_path: str):
             data.sort()
             csv_writer.writerows(data)
 
+
+"""
+Input:  string (containing county name and state, e.g. 'Garfield County, CO')
+
+Output: (county name, state) such as ('Garfield County', 'CO')
+"""
+def split_county_state(string):
+    name, state = string.strip('"').rsplit(", ", 1)
+    return name, state
+
+
+"""
+Input:  input_path:  county_adjacency.txt
+        output_dir:  directory for the per-state files and index.json
+
+Output: index (dict) that maps each state's two-letter code to
+        {"fips": state FIPS code, "file": adjacency file, "counties", "edges"}
+
+Reads county_adjacency.txt once and builds the adjacency of every state, with
+counties identified by their 5-digit FIPS code instead of their name. Only
+edges between counties of the same state are kept.
+
+Each state is written to <state FIPS>.npz holding:
+    fips:     county FIPS codes (int32), sorted
+    names:    county names, in the same order
+    indptr, indices: CSR adjacency, so the neighbors of county i are
+              indices[indptr[i]:indptr[i + 1]] (positions into fips)
+
+index.json lists every state, so building a graph for any state is a lookup
+(see load_state_adjacency) rather than another scan of the text file.
+"""
+def build_state_adjacency(input_path: str, output_dir: str) -> dict:
+
+    # per state: {county FIPS: name} and a set of (smaller FIPS, larger FIPS) edges
+    names = dict()
+    edges = dict()
+    states = dict()
+
+    # the Census file is Latin-1 (e.g. Puerto Rico's municipio names)
+    with open(input_path, "r", encoding = "latin-1") as input_file:
+
+        target = None
+        for line in input_file:
+
+            # row = ['"Autauga County, AL"', '01001', '"Chilton County, AL"', '01021']
+            # or    ['', '', '"Chilton County, AL"', '01021'] for later neighbors
+            # a few lines have the target's FIPS code but not its name, so
+            # names are taken from the neighbor column, where every county
+            # lists itself
+            row = line.rstrip("\n").split("\t")
+            try:
+                if row[1] != "":
+                    target = int(row[1])
+                    edges.setdefault(target // 1000, set())
+
+                neighbor = int(row[3])
+                name, state = split_county_state(row[2])
+                states[state] = neighbor // 1000
+                names.setdefault(neighbor // 1000, dict())[neighbor] = name
+
+                # keep edges inside the target's state, without self loops
+                if neighbor // 1000 == target // 1000 and neighbor != target:
+                    edges[target // 1000].add((min(target, neighbor), max(target, neighbor)))
+
+            except Exception as e:
+                print(str(e))
+
+    os.makedirs(output_dir, exist_ok = True)
+    index = dict()
+    for state, state_fips in sorted(states.items()):
+        edges.setdefault(state_fips, set())
+        fips = np.array(sorted(names[state_fips]), dtype = np.int32)
+        position = {county: i for i, county in enumerate(fips.tolist())}
+
+        # both directions of every edge, sorted by (county, neighbor)
+        pairs = [(position[u], position[v]) for u, v in edges[state_fips]]
+        pairs += [(v, u) for u, v in pairs]
+        pairs = np.array(sorted(pairs), dtype = np.int32).reshape(-1, 2)
+        indptr = np.zeros(len(fips) + 1, dtype = np.int32)
+        indptr[1:] = np.cumsum(np.bincount(pairs[:, 0], minlength = len(fips)))
+
+        file_name = f"{state_fips:02d}.npz"
+        np.savez(os.path.join(output_dir, file_name), fips = fips,
+                 names = np.array([names[state_fips][county] for county in fips.tolist()]),
+                 indptr = indptr, indices = pairs[:, 1])
+        index[state] = dict(fips = f"{state_fips:02d}", file = file_name,
+                            counties = len(fips), edges = len(edges[state_fips]))
+
+    with open(os.path.join(output_dir, "index.json"), "w") as index_file:
+        json.dump(index, index_file, indent = 2)
+
+    return index
+
+
+"""
+Input:  output_dir:  directory written by build_state_adjacency
+        state:       two-letter code ('CO') or FIPS code ('08')
+
+Output: dict with the fips, names, indptr and indices arrays of that state
+"""
+def load_state_adjacency(output_dir: str, state: str) -> dict:
+    with open(os.path.join(output_dir, "index.json"), "r") as index_file:
+        index = json.load(index_file)
+
+    entry = index.get(state)
+    if entry is None:
+        entry = next((entry for entry in index.values() if entry["fips"] == state), None)
+    if entry is None:
+        raise KeyError(f"no adjacency for state {state!r}")
+
+    with np.load(os.path.join(output_dir, entry["file"])) as data:
+        return {key: data[key] for key in data.files}
+
+
 # main method that calls the web scraper function
+# pass --all-states to write the adjacency of every state instead of county.csv
 if __name__ == "__main__":
     input_path = "scrape/contiguity/county_adjacency.txt"
-    output_path = "county.csv"
-    find_colorado_counties(input_path, output_path)
+    if "--all-states" in sys.argv:
+        build_state_adjacency(input_path, "scrape/contiguity/states")
+    else:
+        output_path = "county.csv"
+        find_colorado_counties(input_path, output_path)
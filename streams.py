@@ -0,0 +1,113 @@
+import itertools
+import operator
+import numpy as np
+
+
+"""
+Random streams
+Every chain draws its random numbers from its own RandomStream, a
+numpy.random.Generator read in pre-drawn blocks of uniforms. Streams for
+several chains come from one master seed through SeedSequence.spawn, so
+chain i always gets the same stream no matter how many workers there are or
+in which order the chains are run.
+
+A single draw from a Generator costs about a microsecond of Python overhead,
+more than a whole step of CutEdgeMoveGenerator spends on everything else, so
+the stream draws block_size uniforms at once and hands them out one by one.
+Everything in the engine only calls rng.random() (and mcmc_driver also calls
+rng.choice()), so a random.Random still works wherever a stream is expected.
+"""
+
+# uniforms drawn from the Generator at a time
+BLOCK_SIZE = 4096
+
+
+"""
+RandomStream class
+Inputs: seed:       int, numpy.random.SeedSequence or numpy.random.Generator;
+                    None for fresh entropy
+        block_size: uniforms drawn from the Generator at a time
+
+    stream.random()       next uniform in [0, 1)
+    stream.choice(items)  uniformly random element of a sequence
+    stream.getstate()     state to continue the stream from, see setstate
+
+random is the __next__ of an itertools.chain over the blocks, so a draw is a
+single call into C, as cheap as random.Random.random.
+
+The state is the Generator's state before the current block was drawn plus
+the position in that block, so it stays small however large the block is.
+"""
+class RandomStream:
+
+    def __init__(self, seed = None, block_size = BLOCK_SIZE):
+        if isinstance(seed, np.random.Generator):
+            generator = seed
+        else:
+            generator = np.random.default_rng(seed)
+        self._start(generator, block_size)
+
+
+    # begin handing out blocks of uniforms drawn from generator
+    def _start(self, generator, block_size):
+        self.generator = generator
+        self.block_size = block_size
+        blocks = self._blocks()
+        first = next(blocks)
+        uniforms = itertools.chain(first, itertools.chain.from_iterable(blocks))
+        self.random = uniforms.__next__
+
+
+    # endless sequence of blocks, each an iterator over a list of uniforms
+    def _blocks(self):
+        while True:
+            self.block_state = self.generator.bit_generator.state
+            self.iterator = iter(self.generator.random(self.block_size).tolist())
+            yield self.iterator
+
+
+    def choice(self, items):
+        return items[int(self.random() * len(items))]
+
+
+    # number of uniforms of the current block already handed out
+    @property
+    def position(self) -> int:
+        return self.block_size - operator.length_hint(self.iterator)
+
+
+    def getstate(self) -> dict:
+        return dict(
+            block_state = self.block_state,
+            block_size = self.block_size,
+            position = self.position
+        )
+
+
+    # continue exactly where the stream that produced state left off
+    def setstate(self, state):
+        bit_generator = getattr(np.random, state["block_state"]["bit_generator"])()
+        bit_generator.state = state["block_state"]
+        self._start(np.random.Generator(bit_generator), state["block_size"])
+        for _ in range(state["position"]):
+            next(self.iterator)
+
+
+    # sent to worker processes by state, which is far smaller than the block
+    def __getstate__(self):
+        return self.getstate()
+
+    def __setstate__(self, state):
+        self.setstate(state)
+
+
+# independent seeds for n chains, derived from one master seed
+def spawn_seeds(seed, n) -> list:
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+
+# independent streams for n chains, derived from one master seed
+def spawn_streams(seed, n, block_size = BLOCK_SIZE) -> list:
+    return [RandomStream(child, block_size) for child in spawn_seeds(seed, n)]
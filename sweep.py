@@ -0,0 +1,146 @@
+import itertools
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from chain import run_chain, plan_to_assignment
+from streams import spawn_seeds
+
+
+# fields of the sweep index, one row per point of the parameter grid
+INDEX_FIELDS = [
+    ("point", np.int64),
+    ("lambda_J", np.float64),
+    ("beta", np.float64),
+    ("c_pop", np.float64),
+    ("c_pvi", np.float64)
+]
+
+
+# run every task on the pool (or in this process), keeping the task order
+def _run_tasks(pool, tasks) -> list:
+    if pool is None:
+        return [run_chain(*args, **kwargs) for args, kwargs in tasks]
+    futures = [pool.submit(run_chain, *args, **kwargs) for args, kwargs in tasks]
+    return [future.result() for future in futures]
+
+
+"""
+run_sweep function
+Runs the MCMC chain over a grid of lambda_J, beta, c_pop and c_pvi values.
+
+Inputs: graph:         networkx graph or csr_graph.CSRGraph, e.g. from
+                       get_colorado_graph
+        initial_plan:  starting plan for the burn-in
+        lambda_Js, betas, c_pops, c_pvis: values of each parameter to sweep
+        n_chains:      number of chains per grid point
+        n_steps:       number of recorded MCMC iterations per chain
+        burn_in:       number of burn-in iterations per chain
+        burn_in_beta:  beta used for burn-in (default: the smallest beta)
+        workers:       number of worker processes (default: every core)
+        seed:          master seed; every burn-in and every chain gets its own
+                       seed spawned from it (see streams.py)
+        output_path:   if given, the results are also saved there (see save_sweep)
+Output: Dictionary of results
+            index:       structured array of the grid, one row per point
+            scores:      (points, n_chains, n_steps) scores
+            accepted:    (points, n_chains, n_steps) acceptance flags
+            assignments: (points, n_chains, nodes) final plans
+
+The score only depends on lambda_J, c_pop and c_pvi, so grid points that share
+them share a single burn-in: it is run once per combination and chain i of
+every beta starts from the same burned-in plan. Burn-ins, and then every chain
+of every grid point, are spread across one process pool.
+"""
+def run_sweep(graph, initial_plan, lambda_Js = (1,), betas = (0.05,),
+              c_pops = (0.3,), c_pvis = (0.00003,), n_chains = 1, n_steps = 1000,
+              burn_in = 0, burn_in_beta = None, workers = None, seed = 46,
+              output_path = None) -> dict:
+    points = list(itertools.product(lambda_Js, betas, c_pops, c_pvis))
+    index = np.array(
+        [(i,) + point for i, point in enumerate(points)], dtype = INDEX_FIELDS
+    )
+
+    if burn_in_beta is None:
+        burn_in_beta = min(betas)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = plan_to_assignment(graph, initial_plan)
+    score_groups = list(dict.fromkeys(
+        (lambda_J, c_pop, c_pvi) for lambda_J, _, c_pop, c_pvi in points
+    ))
+
+    # seeds follow the task order, so they do not depend on the number of workers
+    burn_in_root, chain_root = spawn_seeds(seed, 2)
+    burn_in_seeds = spawn_seeds(burn_in_root, len(score_groups) * n_chains)
+    chain_seeds = spawn_seeds(chain_root, len(points) * n_chains)
+
+    pool = ProcessPoolExecutor(max_workers = workers) if workers > 1 else None
+    try:
+
+        # one burn-in per chain for each distinct score function
+        starts = {group: [start] * n_chains for group in score_groups}
+        if burn_in > 0:
+            tasks = [
+                ((graph, start, burn_in, burn_in_seeds[g * n_chains + c]),
+                 dict(beta = burn_in_beta, lambda_J = lambda_J, c_pop = c_pop, c_pvi = c_pvi))
+                for g, (lambda_J, c_pop, c_pvi) in enumerate(score_groups)
+                for c in range(n_chains)
+            ]
+            results = _run_tasks(pool, tasks)
+            for g, group in enumerate(score_groups):
+                starts[group] = [r["assignment"]
+                                 for r in results[g * n_chains:(g + 1) * n_chains]]
+
+        # every chain of every grid point
+        tasks = [
+            ((graph, starts[(lambda_J, c_pop, c_pvi)][c], n_steps,
+              chain_seeds[p * n_chains + c]),
+             dict(beta = beta, lambda_J = lambda_J, c_pop = c_pop, c_pvi = c_pvi))
+            for p, (lambda_J, beta, c_pop, c_pvi) in enumerate(points)
+            for c in range(n_chains)
+        ]
+        results = _run_tasks(pool, tasks)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    shape = (len(points), n_chains)
+    sweep = dict(
+        index = index,
+        scores = np.stack([r["scores"] for r in results]).reshape(shape + (n_steps,)),
+        accepted = np.stack([r["accepted"] for r in results]).reshape(shape + (n_steps,)),
+        assignments = np.stack([r["assignment"] for r in results]).reshape(shape + (-1,))
+    )
+
+    if output_path is not None:
+        save_sweep(sweep, output_path)
+
+    return sweep
+
+
+# save sweep results to a single compressed .npz file
+def save_sweep(sweep, output_path):
+    np.savez_compressed(output_path, **sweep)
+
+
+# load sweep results saved by save_sweep
+def load_sweep(input_path) -> dict:
+    with np.load(input_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+"""
+select_points function
+Inputs: sweep:      results from run_sweep or load_sweep
+        parameters: values to match, e.g. lambda_J = 0.5, beta = 0.05
+Output: Rows of sweep["index"] matching every given parameter value
+
+Use the "point" column of the rows to index scores, accepted and assignments.
+"""
+def select_points(sweep, **parameters):
+    index = sweep["index"]
+    mask = np.ones(len(index), dtype = bool)
+    for name, value in parameters.items():
+        mask &= np.isclose(index[name], value)
+    return index[mask]
@@ -0,0 +1,205 @@
+import math
+import multiprocessing
+import numpy as np
+from partition import Partition
+from chain import MarkovChain, plan_to_assignment
+from streams import RandomStream, spawn_seeds
+
+
+# carry out one command on a group of replicas, returning its answer (if any)
+def _run_command(chains, command, argument):
+
+    # advance every replica, answering with their scores and acceptance flags
+    if command == "run":
+        return {i: chain.run(argument) for i, chain in chains.items()}
+
+    # replicas swapped temperatures
+    if command == "set_betas":
+        for i, beta in argument.items():
+            chains[i].beta = beta
+        return None
+
+    if command == "assignments":
+        return {i: chain.partition.assignment.copy() for i, chain in chains.items()}
+
+    # call a module level function(chain, *args) on every replica, answering
+    # with its results (used by diagnostics.run_until_converged)
+    if command == "call":
+        function, args = argument
+        return {i: function(chain, *args) for i, chain in chains.items()}
+
+    raise ValueError(f"unknown replica command {command!r}")
+
+
+# worker process loop: run commands sent by ReplicaGroup until told to stop
+def _replica_worker(connection, chains):
+    while True:
+        command, argument = connection.recv()
+        if command == "stop":
+            connection.close()
+            return
+        result = _run_command(chains, command, argument)
+        if result is not None:
+            connection.send(result)
+
+
+"""
+ReplicaGroup class
+The replicas owned by one worker. With a process it forwards each command
+over a pipe, otherwise it runs the replicas directly in this process.
+"""
+class ReplicaGroup:
+
+    def __init__(self, chains, use_process):
+        self.chains = chains
+        self.process = None
+        if use_process:
+            self.connection, child = multiprocessing.Pipe()
+            self.process = multiprocessing.Process(
+                target = _replica_worker, args = (child, chains), daemon = True
+            )
+            self.process.start()
+            child.close()
+
+    # start a command without waiting for its answer
+    def send(self, command, argument = None):
+        if self.process is not None:
+            self.connection.send((command, argument))
+        else:
+            self.result = _run_command(self.chains, command, argument)
+
+    # wait for the answer to the last command
+    def receive(self):
+        if self.process is not None:
+            return self.connection.recv()
+        return self.result
+
+    def stop(self):
+        if self.process is not None:
+            self.connection.send(("stop", None))
+            self.process.join()
+            self.connection.close()
+
+
+"""
+run_parallel_tempering function
+Replica exchange: one chain per beta, run in parallel, with periodic attempts
+to swap the plans of chains at neighboring betas. Low betas explore freely and
+hand good plans down to high betas, which helps the chain off of plateaus.
+
+Inputs: graph:         networkx graph or csr_graph.CSRGraph, e.g. from
+                       get_colorado_graph
+        initial_plan:  starting plan for every replica
+        betas:         ladder of beta values, e.g. [0.002, 0.01, 0.05]
+        n_steps:       number of MCMC iterations per replica
+        swap_interval: iterations between rounds of swap attempts
+        workers:       number of worker processes (default: one per beta),
+                       workers = 1 runs every replica in this process
+        seed:          master seed for the replicas and the swap decisions
+        remaining keyword arguments are passed on to MarkovChain
+Output: Dictionary of results, indexed by position in the sorted beta ladder
+            betas:        sorted betas
+            scores:       (n_betas, n_steps) scores seen at each beta
+            accepted:     (n_betas, n_steps) acceptance flags at each beta
+            assignments:  (n_betas, number of nodes) final plan at each beta
+            swap_rates:   acceptance rate of swaps between betas i and i + 1
+            swap_attempts, swap_accepts: counts behind swap_rates
+
+Swapping plans between two betas is done by swapping the betas of the two
+replicas, so plans never have to be sent between processes.
+"""
+def run_parallel_tempering(graph, initial_plan, betas, n_steps, swap_interval = 10,
+                           workers = None, seed = 46, **chain_args) -> dict:
+    betas = sorted(betas)
+    n_betas = len(betas)
+    if n_betas < 2:
+        raise ValueError("parallel tempering needs at least two betas")
+
+    # one stream per replica, plus one for the swap decisions
+    seeds = spawn_seeds(seed, n_betas + 1)
+    rng = RandomStream(seeds[-1])
+    assignment = plan_to_assignment(graph, initial_plan)
+    chains = [
+        MarkovChain(Partition(graph, assignment), beta, rng = RandomStream(seeds[i]),
+                    **chain_args)
+        for i, beta in enumerate(betas)
+    ]
+
+    # replica_at[b] is the replica currently running at betas[b]
+    replica_at = list(range(n_betas))
+    energies = [chain.score for chain in chains]
+
+    if workers is None:
+        workers = n_betas
+    workers = max(1, min(workers, n_betas))
+    groups = [
+        ReplicaGroup({i: chains[i] for i in range(w, n_betas, workers)}, workers > 1)
+        for w in range(workers)
+    ]
+
+    scores = np.empty((n_betas, n_steps))
+    accepted = np.empty((n_betas, n_steps), dtype = bool)
+    swap_attempts = np.zeros(n_betas - 1, dtype = np.int64)
+    swap_accepts = np.zeros(n_betas - 1, dtype = np.int64)
+
+    try:
+        step = 0
+        round_number = 0
+        while step < n_steps:
+            length = min(swap_interval, n_steps - step)
+
+            # advance every replica in parallel
+            for group in groups:
+                group.send("run", length)
+            replica_at_beta = {r: b for b, r in enumerate(replica_at)}
+            for group in groups:
+                for i, (replica_scores, replica_accepted) in group.receive().items():
+                    b = replica_at_beta[i]
+                    scores[b, step:step + length] = replica_scores
+                    accepted[b, step:step + length] = replica_accepted
+                    energies[i] = replica_scores[-1]
+            step += length
+            if step >= n_steps:
+                break
+
+            # attempt swaps between even pairs, then odd pairs, on alternate rounds
+            new_betas = {}
+            for b in range(round_number % 2, n_betas - 1, 2):
+                i, j = replica_at[b], replica_at[b + 1]
+                exponent = (betas[b] - betas[b + 1]) * (energies[i] - energies[j])
+                probability = 1.0 if exponent >= 0 else math.exp(exponent)
+
+                swap_attempts[b] += 1
+                if rng.random() < probability:
+                    swap_accepts[b] += 1
+                    replica_at[b], replica_at[b + 1] = j, i
+                    new_betas[j] = betas[b]
+                    new_betas[i] = betas[b + 1]
+            round_number += 1
+
+            if new_betas:
+                for group in groups:
+                    group.send("set_betas", {i: beta for i, beta in new_betas.items()
+                                             if i in group.chains})
+
+        final = {}
+        for group in groups:
+            group.send("assignments")
+        for group in groups:
+            final.update(group.receive())
+    finally:
+        for group in groups:
+            group.stop()
+
+    swap_rates = np.divide(swap_accepts, swap_attempts,
+                           out = np.zeros(n_betas - 1), where = swap_attempts > 0)
+
+    return dict(
+        betas = betas,
+        scores = scores,
+        accepted = accepted,
+        assignments = np.stack([final[replica_at[b]] for b in range(n_betas)]),
+        swap_rates = swap_rates,
+        swap_attempts = swap_attempts,
+        swap_accepts = swap_accepts
+    )
@@ -0,0 +1,250 @@
+import json
+import os
+import numpy as np
+
+
+"""
+Trajectory files
+A chain's output is stored in a directory of append-only chunks:
+
+    meta.json                 chunk lengths and layout, rewritten atomically
+    scores_000000.npy         float64 score after each step
+    accepted_000000.npy       bool acceptance flag of each step
+    assignments_000000.npy    (steps, nodes) plan after each recorded step
+
+A chunk file is written once, when its chunk fills up (or the writer is
+closed), and is only listed in meta.json after it is complete. If the process
+dies, everything up to the last finished chunk is still readable.
+"""
+
+META_FILE = "meta.json"
+
+
+# path of one chunk file of a trajectory
+def chunk_path(path, name, chunk) -> str:
+    return os.path.join(path, f"{name}_{chunk:06d}.npy")
+
+
+# write json to a temporary file and rename it, so readers never see half a file
+def write_json_atomic(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as output_file:
+        json.dump(data, output_file)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    os.replace(temp_path, path)
+
+
+"""
+TrajectoryWriter class
+Streams the scores, acceptance flags and plans of a chain to disk.
+
+Inputs: path:              directory for the trajectory (created if needed);
+                           an existing trajectory is appended to
+        num_nodes:         number of nodes in each plan
+        num_districts:     number of districts, used to pick a compact dtype
+        chunk_size:        steps buffered in memory before a chunk is written
+        assignment_stride: store the plan every this many steps
+                           (0 to store no plans at all)
+
+A writer can be passed to MarkovChain.run as an observer.
+"""
+class TrajectoryWriter:
+
+    def __init__(self, path, num_nodes, num_districts, chunk_size = 10000,
+                 assignment_stride = 1):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                self.meta = json.load(meta_file)
+            if (self.meta["num_nodes"] != num_nodes
+                    or self.meta["assignment_stride"] != assignment_stride):
+                raise ValueError(f"{path} holds a trajectory with a different layout")
+        else:
+            self.meta = dict(
+                num_nodes = num_nodes,
+                assignment_stride = assignment_stride,
+                assignment_dtype = np.min_scalar_type(max(num_districts - 1, 0)).str,
+                chunks = []
+            )
+            write_json_atomic(meta_path, self.meta)
+
+        self.chunk_size = chunk_size
+        self.assignment_stride = assignment_stride
+        self.assignment_dtype = np.dtype(self.meta["assignment_dtype"])
+
+        # steps already on disk, so appended steps continue the numbering
+        self.step = sum(chunk["length"] for chunk in self.meta["chunks"])
+
+        self.scores = np.empty(chunk_size)
+        self.accepted = np.empty(chunk_size, dtype = bool)
+        self.assignments = []
+        self.buffered = 0
+
+
+    # record one step of a chain
+    def append(self, score, accepted, assignment = None):
+        self.scores[self.buffered] = score
+        self.accepted[self.buffered] = accepted
+        if self.assignment_stride and self.step % self.assignment_stride == 0:
+            self.assignments.append(np.asarray(assignment, dtype = self.assignment_dtype))
+
+        self.buffered += 1
+        self.step += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+
+    # observer hook used by MarkovChain.run
+    def observe(self, chain, move, accepted):
+        self.append(chain.score, accepted, chain.partition.assignment)
+
+
+    # write the buffered steps as a new chunk
+    def flush(self):
+        if self.buffered == 0:
+            return
+
+        chunk = len(self.meta["chunks"])
+        np.save(chunk_path(self.path, "scores", chunk), self.scores[:self.buffered])
+        np.save(chunk_path(self.path, "accepted", chunk), self.accepted[:self.buffered])
+        if self.assignment_stride:
+            assignments = np.array(self.assignments, dtype = self.assignment_dtype)
+            assignments = assignments.reshape(-1, self.meta["num_nodes"])
+            np.save(chunk_path(self.path, "assignments", chunk), assignments)
+
+        # only now does the chunk become part of the trajectory
+        self.meta["chunks"].append(dict(length = self.buffered))
+        write_json_atomic(os.path.join(self.path, META_FILE), self.meta)
+
+        self.buffered = 0
+        self.assignments = []
+
+
+    # drop every stored step after the first `steps`, e.g. steps written after
+    # the checkpoint a chain is resuming from; steps must end on a chunk boundary
+    def truncate(self, steps):
+        kept = []
+        total = 0
+        for chunk in self.meta["chunks"]:
+            if total + chunk["length"] > steps:
+                break
+            kept.append(chunk)
+            total += chunk["length"]
+        if total != steps:
+            raise ValueError(f"{self.path} cannot be cut back to step {steps}")
+        if len(kept) == len(self.meta["chunks"]):
+            return
+
+        self.meta["chunks"] = kept
+        write_json_atomic(os.path.join(self.path, META_FILE), self.meta)
+        self.step = total
+        self.buffered = 0
+        self.assignments = []
+
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+"""
+ChunkedArray class
+Read-only view of a per-step array split across memory-mapped chunk files.
+Supports len(), integer indexing and slicing; only the chunks that overlap
+the requested steps are touched.
+"""
+class ChunkedArray:
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.offsets = np.cumsum([0] + [len(chunk) for chunk in chunks])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, stride = key.indices(len(self))
+
+            # read the steps in ascending order, then reverse them
+            if stride < 0:
+                steps = range(start, stop, stride)
+                if not steps:
+                    return self[0:0]
+                return self[steps[-1]:steps[0] + 1:-stride][::-1]
+
+            # slice each overlapping chunk directly on the step grid, so only the
+            # requested rows are ever read
+            pieces = []
+            first = max(int(np.searchsorted(self.offsets, start, side = "right")) - 1, 0)
+            for c in range(first, len(self.chunks)):
+                offset = int(self.offsets[c])
+                if offset >= stop:
+                    break
+                low = max(start, offset)
+                low += -(low - start) % stride
+                if low < min(stop, int(self.offsets[c + 1])):
+                    pieces.append(self.chunks[c][low - offset:stop - offset:stride])
+            if not pieces:
+                return np.empty((0,) + self.chunks[0].shape[1:]) if self.chunks else np.empty(0)
+            return np.concatenate(pieces)
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("step out of range")
+        c = int(np.searchsorted(self.offsets, key, side = "right")) - 1
+        return self.chunks[c][key - self.offsets[c]]
+
+
+"""
+TrajectoryReader class
+Memory-maps a trajectory written by TrajectoryWriter, so any range of steps
+can be sliced out without loading the whole run.
+
+    reader.scores[1000:2000]     scores of steps 1000 to 1999
+    reader.accepted[-1]          acceptance flag of the last step
+    reader.assignment(step)      plan after a step (needs assignment_stride)
+"""
+class TrajectoryReader:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as meta_file:
+            self.meta = json.load(meta_file)
+
+        n_chunks = len(self.meta["chunks"])
+        self.scores = ChunkedArray([
+            np.load(chunk_path(path, "scores", c), mmap_mode = "r") for c in range(n_chunks)
+        ])
+        self.accepted = ChunkedArray([
+            np.load(chunk_path(path, "accepted", c), mmap_mode = "r") for c in range(n_chunks)
+        ])
+
+        # assignments[i] is the plan after step i * assignment_stride
+        self.assignment_stride = self.meta["assignment_stride"]
+        if self.assignment_stride:
+            self.assignments = ChunkedArray([
+                np.load(chunk_path(path, "assignments", c), mmap_mode = "r")
+                for c in range(n_chunks)
+            ])
+        else:
+            self.assignments = None
+
+    def __len__(self):
+        return len(self.scores)
+
+    # plan after a step, which must be a multiple of assignment_stride
+    def assignment(self, step):
+        if self.assignments is None or step % self.assignment_stride:
+            raise KeyError(f"the plan after step {step} was not stored")
+        return np.asarray(self.assignments[step // self.assignment_stride])